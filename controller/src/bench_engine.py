@@ -0,0 +1,113 @@
+#!/usr/bin/env python
+
+import json
+import os.path
+import resource
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+ENGINES = ['tf', 'numpy', 'int8']
+
+
+def run_engine(engine, model_file, weights_file, sample_file, output_file, frames):
+    """
+    Measure an inference engine in this process and print the result as JSON.
+    Startup covers imports, model creation and the first prediction.
+    """
+    start = time.time()
+    import numpy as np
+    images = np.load(sample_file)
+    if engine == 'tf':
+        from cnn import CNN
+        predict_proba = CNN(list(images.shape[1:]), model_file=model_file).predict_proba
+    elif engine == 'numpy':
+        from engine import NumpyPilot
+        predict_proba = NumpyPilot(weights_file).predict_proba
+    else:
+        from quantize import Int8Pilot
+        predict_proba = Int8Pilot(weights_file.replace('.npz', '.int8.npz')).predict_proba
+    predict_proba(images[:1])
+    startup = time.time() - start
+    # Latency of single frames, as in the streamer
+    latencies = []
+    for image in images[:frames]:
+        start = time.time()
+        predict_proba(image[None])
+        latencies.append(time.time() - start)
+    np.save(output_file, np.concatenate([predict_proba(images[i:i+100]) for i in range(0, len(images), 100)]))
+    print(json.dumps({
+        'startup': startup,
+        'rss': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024,
+        'latency': float(np.median(latencies)),
+        'latency_p99': float(np.percentile(latencies, 99))
+    }))
+
+
+def main():
+    # Parse arguments
+    import argparse
+    import config
+    parser = argparse.ArgumentParser(description='Compare the TensorFlow, NumPy and int8 inference engines.')
+    parser.add_argument('--model_file', type=str, default=config.model_file)
+    parser.add_argument('--data_dir', type=str, default=config.data_dir)
+    parser.add_argument('--samples', type=int, default=1000, help='Frames compared between engines')
+    parser.add_argument('--frames', type=int, default=200, help='Frames timed one by one')
+    parser.add_argument('--engine', choices=ENGINES, help=argparse.SUPPRESS)
+    parser.add_argument('--weights_file', type=str, help=argparse.SUPPRESS)
+    parser.add_argument('--sample_file', type=str, help=argparse.SUPPRESS)
+    parser.add_argument('--output_file', type=str, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    # Worker process
+    if args.engine:
+        run_engine(args.engine, args.model_file, args.weights_file, args.sample_file, args.output_file, args.frames)
+        return
+
+    import numpy as np
+    from dataset import DataFile
+    from engine import export_weights
+    from quantize import quantize
+    work_dir = tempfile.mkdtemp()
+    try:
+        weights_file = os.path.join(work_dir, 'weights.npz')
+        sample_file = os.path.join(work_dir, 'sample.npy')
+        export_weights(args.model_file, weights_file)
+        observation = DataFile(args.data_dir).observation
+        sample = observation[np.random.choice(len(observation), min(args.samples, len(observation)), False)]
+        np.save(sample_file, sample)
+        quantize(weights_file, sample, weights_file.replace('.npz', '.int8.npz'))
+        # Run every engine in a fresh process, so startup and memory are not shared
+        results = {}
+        for engine in ENGINES:
+            output_file = os.path.join(work_dir, engine + '.npy')
+            output = subprocess.check_output([sys.executable, __file__, '--engine', engine,
+                                              '--model_file', args.model_file,
+                                              '--weights_file', weights_file,
+                                              '--sample_file', sample_file,
+                                              '--output_file', output_file,
+                                              '--frames', str(args.frames)])
+            results[engine] = json.loads(output.decode().strip().splitlines()[-1])
+            results[engine]['probs'] = np.load(output_file)
+    finally:
+        shutil.rmtree(work_dir)
+    print('%-8s %10s %10s %12s %12s' % ('engine', 'startup s', 'rss MB', 'latency ms', 'p99 ms'))
+    for engine in ENGINES:
+        result = results[engine]
+        # The int8 engine simulates int8 arithmetic in float32, its latency says nothing about int8
+        if engine == 'int8':
+            print('%-8s %10.2f %10.0f %12s %12s' % (engine, result['startup'], result['rss'], '-', '-'))
+            continue
+        print('%-8s %10.2f %10.0f %12.2f %12.2f' % (engine, result['startup'], result['rss'],
+                                                     result['latency'] * 1000, result['latency_p99'] * 1000))
+    probs_tf = results['tf']['probs']
+    for engine in ENGINES[1:]:
+        probs = results[engine]['probs']
+        print('%s max abs difference of softmax: %g' % (engine, np.max(np.abs(probs_tf - probs))))
+        print('%s argmax agreement: %.4f' % (engine, np.mean(np.argmax(probs_tf, 1) == np.argmax(probs, 1))))
+
+
+if __name__ == '__main__':
+    main()
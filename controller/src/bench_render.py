@@ -0,0 +1,110 @@
+#!/usr/bin/env python
+
+import time
+
+import cv2
+import numpy as np
+
+import config
+from editor import FrameEditor
+
+
+class LegacyFrameEditor(FrameEditor):
+    """
+    The frame editor before buffers and icons were cached, as the baseline.
+    """
+
+    def __init__(self, *args):
+        super().__init__(*args)
+        self.mask_color = np.zeros([self.height, self.width, 3])
+        self.mask_color[:, :, 1] = 255
+        self.mask_full = np.zeros([self.height, self.width, 1])
+
+    def set_frame(self, frame: np.ndarray):
+        self.image = frame.copy()
+        self.frame = frame.copy()
+        self.mask = None
+
+    def set_salient(self, mask: np.ndarray):
+        self.mask = cv2.resize(mask, (self.watch_width, self.watch_height))
+
+    def render(self, draw_salient: bool=True, draw_prob: bool=True, draw_border: bool=True):
+        output_img = self.frame.copy()
+        # Draw directions
+        if draw_prob:
+            bar_overlay = output_img.copy()
+            icon_top = self.DIRECTION_PADDING
+            icon_bottom = self.DIRECTION_PADDING + self.DIRECTION_WIDTH
+            bar_bottom = icon_bottom+self.DIRECTION_PADDING + self.DIRECTION_HEIGHT
+            for i in range(len(self.direction)):
+                # Draw background rectangle
+                bar_left = self.DIRECTION_PADDING + (self.DIRECTION_WIDTH + self.DIRECTION_MARGIN) * i
+                bar_right = bar_left+self.DIRECTION_WIDTH
+                bar_top = icon_bottom + self.DIRECTION_PADDING
+                bar_overlay = cv2.rectangle(bar_overlay, (bar_left,bar_top), (bar_right,bar_bottom), (255,255,255), -1)
+            output_img = cv2.addWeighted(output_img, 0.5, bar_overlay, 0.5, 0)
+            for i in range(len(self.direction)):
+                # Draw foreground rectangle
+                bar_left = self.DIRECTION_PADDING + (self.DIRECTION_WIDTH + self.DIRECTION_MARGIN) * i
+                bar_right = bar_left+self.DIRECTION_WIDTH
+                bar_top = bar_bottom-int(self.DIRECTION_HEIGHT * self.direction[i])
+                output_img = cv2.rectangle(output_img, (bar_left, bar_top), (bar_right, bar_bottom), (255, 255, 255), -1)
+                # Draw icon
+                icon = cv2.imread(self.DIRECTION_ICONS[i])
+                output_img = self.draw_image(output_img, icon, bar_left, icon_top, bar_right, icon_bottom)
+        # Draw watch area
+        if draw_border:
+            output_img = cv2.rectangle(output_img, (self.watch_left, self.watch_top), (self.watch_right - 1, self.watch_bottom - 1), (255, 255, 255))
+        # Draw salient map
+        if draw_salient and self.mask is not None:
+            min_weight = np.min(self.mask)
+            max_weight = np.max(self.mask)
+            if np.abs(max_weight-min_weight) > 0:
+                mask_normed = (self.mask-min_weight)/(max_weight-min_weight)
+                mask_scaled = cv2.resize(mask_normed, (self.watch_right - self.watch_left, self.watch_bottom - self.watch_top))
+
+                self.mask_full[self.watch_top:self.watch_bottom, self.watch_left:self.watch_right, 0] = mask_scaled
+                output_img = output_img * (1 - self.mask_full) + self.mask_color * self.mask_full
+        return output_img.astype(np.uint8)
+
+
+def render_time(editor: FrameEditor, frames, directions, salients, draw_salient) -> tuple:
+    """
+    Render frames as the renderer of MainForm does, a salient map is shared by several frames.
+    :return: seconds per frame, the last rendered frame
+    """
+    start = time.time()
+    for i, frame in enumerate(frames):
+        editor.set_frame(frame)
+        editor.set_direction(directions[i])
+        if draw_salient:
+            editor.set_salient(salients[i // config.salient_interval])
+        output = editor.render(draw_salient=draw_salient, draw_prob=True, draw_border=True)
+    return (time.time() - start) / len(frames), output.copy()
+
+
+def main():
+    # Parse arguments
+    import argparse
+    parser = argparse.ArgumentParser(description='Measure the render time of FrameEditor against the legacy renderer.')
+    parser.add_argument('--frames', type=int, default=300)
+    args = parser.parse_args()
+
+    random = np.random.RandomState(0)
+    frames = random.randint(0, 256, [args.frames, config.stream_height, config.stream_width,
+                                     config.stream_channel]).astype(np.uint8)
+    directions = random.dirichlet(np.ones(3), args.frames)
+    salients = random.rand(args.frames // config.salient_interval + 1, config.observation_height,
+                           config.observation_width, 1).astype(np.float32)
+    shape = (config.stream_height, config.stream_width, config.stream_channel,
+             config.observation_height, config.observation_width)
+    print('%-12s %14s %14s %14s' % ('salient', 'legacy ms', 'cached ms', 'max diff'))
+    for draw_salient in [False, True]:
+        legacy_time, legacy_output = render_time(LegacyFrameEditor(*shape), frames, directions, salients, draw_salient)
+        cached_time, cached_output = render_time(FrameEditor(*shape), frames, directions, salients, draw_salient)
+        difference = np.max(np.abs(legacy_output.astype(np.int16) - cached_output))
+        print('%-12s %14.3f %14.3f %14d' % (draw_salient, legacy_time * 1000, cached_time * 1000, difference))
+
+
+if __name__ == '__main__':
+    main()
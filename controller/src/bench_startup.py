@@ -0,0 +1,46 @@
+#!/usr/bin/env python
+
+import subprocess
+import sys
+
+import numpy as np
+
+# Modules imported by the controller, from the libraries to the forms
+MODULES = ['numpy', 'cv2', 'PyQt5.QtWidgets', 'matplotlib.backends.backend_qt4agg', 'tensorflow',
+           'config', 'car', 'dataset', 'editor', 'form', 'engine', 'cnn', 'train', 'explorer', 'main']
+
+IMPORT_SCRIPT = 'import time; start = time.perf_counter(); import %s; print(time.perf_counter() - start)'
+
+
+def import_time(module) -> float:
+    """
+    Import a module in a fresh process.
+    :return: seconds to import the module and everything it imports, None if it fails
+    """
+    try:
+        output = subprocess.check_output([sys.executable, '-c', IMPORT_SCRIPT % module], stderr=subprocess.DEVNULL)
+    except subprocess.CalledProcessError:
+        return None
+    return float(output.decode().strip().splitlines()[-1])
+
+
+def main():
+    # Parse arguments
+    import argparse
+    parser = argparse.ArgumentParser(description='Measure the import time of every module of the controller. '
+                                                 'Run "python -X importtime main.py" for a breakdown.')
+    parser.add_argument('--repeat', type=int, default=3, help='Imports timed per module')
+    parser.add_argument('modules', nargs='*', default=MODULES)
+    args = parser.parse_args()
+
+    print('%-36s %10s' % ('module', 'import s'))
+    for module in args.modules:
+        times = [import_time(module) for _ in range(args.repeat)]
+        if None in times:
+            print('%-36s %10s' % (module, 'failed'))
+        else:
+            print('%-36s %10.3f' % (module, np.median(times)))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,79 @@
+#!/usr/bin/env python
+
+import os
+import os.path
+import shutil
+import tempfile
+import time
+
+import numpy as np
+
+import config
+from dataset import DataFile
+
+ENCODINGS = [('raw', None), ('png', 3), ('jpeg', 95), ('jpeg', 75)]
+
+
+def disk_size(data_dir) -> int:
+    return sum(os.path.getsize(os.path.join(data_dir, name)) for name in os.listdir(data_dir))
+
+
+def load_throughput(data_file: DataFile, batch_size=100, num_batches=100) -> float:
+    """
+    Measure how fast random batches are read.
+    :return: frames per second
+    """
+    observation = data_file.observation
+    start = time.time()
+    for _ in range(num_batches):
+        observation[np.random.choice(len(observation), batch_size)]
+    return batch_size * num_batches / (time.time() - start)
+
+
+def train_accuracy(data_file: DataFile, source: DataFile, iters, batch_size) -> float:
+    """
+    Train a model on a data set and validate it on the same split of the source data set,
+    which holds frames as the car sees them.
+    :return: validation accuracy
+    """
+    from cnn import CNN
+    train_obs, train_act, _, _ = data_file.gen_train_set()
+    _, _, test_obs, test_act = source.gen_train_set()
+    model = CNN(list(train_obs.shape[1:]))
+    model.fit(train_obs, train_act, test_obs, test_act,
+              batch_size=batch_size, iters=iters, print_iters=iters, mirror=True, final_eval=False)
+    return model.check_accuracy(test_obs, test_act)
+
+
+def main():
+    # Parse arguments
+    import argparse
+    parser = argparse.ArgumentParser(description='Compare observation encodings of the data set.')
+    parser.add_argument('--data_dir', type=str, default=config.data_dir)
+    parser.add_argument('--frames', type=int, default=0, help='Number of frames to use, 0 for all')
+    parser.add_argument('--train_iters', type=int, default=0, help='Training iterations, 0 to skip training')
+    parser.add_argument('--batch_size', type=int, default=100)
+    args = parser.parse_args()
+
+    work_dir = tempfile.mkdtemp()
+    try:
+        source = DataFile(args.data_dir).copy_to(os.path.join(work_dir, 'source'), frames=args.frames)
+        print('%d frames' % len(source))
+        print('%-12s %12s %10s %14s %10s' % ('encoding', 'bytes', 'ratio', 'frames/s', 'val acc'))
+        raw_size = None
+        for encoding, quality in ENCODINGS:
+            data_dir = os.path.join(work_dir, '%s-%s' % (encoding, quality))
+            data_file = source.copy_to(data_dir, encoding, quality)
+            size = disk_size(data_dir)
+            raw_size = raw_size or size
+            throughput = load_throughput(data_file, args.batch_size)
+            accuracy = train_accuracy(data_file, source, args.train_iters, args.batch_size) \
+                if args.train_iters > 0 else float('nan')
+            print('%-12s %12d %10.2f %14.0f %10.4f' % ('%s/%s' % (encoding, quality), size,
+                                                       raw_size / size, throughput, accuracy))
+    finally:
+        shutil.rmtree(work_dir)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,71 @@
+#!/usr/bin/env python
+
+import time
+from threading import Thread
+
+import numpy as np
+
+import config
+from cnn import CNN, session_config
+from dataset import DataFile
+
+
+def inference_latency(model: CNN, images, frames, until=None) -> list:
+    """
+    Predict frames one by one, as the streamer does.
+    :param until: keep predicting while this thread is alive, after the first frames
+    :return: seconds of every prediction
+    """
+    latencies = []
+    i = 0
+    while i < frames or (until is not None and until.is_alive()):
+        image = images[i % len(images)][None]
+        start = time.time()
+        model.predict_proba(image)
+        latencies.append(time.time() - start)
+        i += 1
+    return latencies
+
+
+def main():
+    # Parse arguments
+    import argparse
+    parser = argparse.ArgumentParser(description='Measure steering latency while the model trains.')
+    parser.add_argument('--data_dir', type=str, default=config.data_dir)
+    parser.add_argument('--iters', type=int, default=200, help='Training iterations run beside inference')
+    parser.add_argument('--frames', type=int, default=200, help='Frames predicted without training')
+    parser.add_argument('--batch_size', type=int, default=100)
+    args = parser.parse_args()
+
+    train_obs, train_act, test_obs, test_act = DataFile(args.data_dir, config.data_file).gen_train_set()
+    images = test_obs[:args.frames]
+    # TensorFlow defaults for both sessions, against the thread pools of config.py
+    settings = [('default', (0, 0), (0, 0)),
+                ('config', config.train_threads, config.inference_threads)]
+    print('%-10s %10s %10s %14s %14s %10s' % ('threads', 'idle ms', 'idle p99', 'training ms', 'training p99',
+                                               'iters/s'))
+    for name, train_threads, inference_threads in settings:
+        model = CNN(list(train_obs.shape[1:]), session_config=session_config(*train_threads),
+                    inference_config=session_config(*inference_threads))
+        model.predict_proba(images[:1])
+        idle = inference_latency(model, images, args.frames)
+        # Train in the background while steering
+        train_time = []
+
+        def train():
+            start = time.time()
+            model.fit(train_obs, train_act, test_obs, test_act, batch_size=args.batch_size,
+                      iters=args.iters, print_iters=args.iters, mirror=True, final_eval=False)
+            train_time.append(time.time() - start)
+
+        thread = Thread(target=train)
+        thread.start()
+        busy = inference_latency(model, images, 0, thread)
+        thread.join()
+        print('%-10s %10.2f %10.2f %14.2f %14.2f %10.1f' % (
+            name, np.median(idle) * 1000, np.percentile(idle, 99) * 1000,
+            np.median(busy) * 1000, np.percentile(busy, 99) * 1000, args.iters / train_time[0]))
+
+
+if __name__ == '__main__':
+    main()
@@ -1,7 +1,11 @@
 import socket
+import time
+from threading import Condition, Thread
 
 import cv2
 
+from mjpeg import MjpegStream
+
 
 class Car:
 
@@ -10,7 +14,9 @@ class Car:
                  turn_speed,
                  control_port=8081,
                  camera_port=8080,
-                 time_out=1):
+                 time_out=1,
+                 camera_time_out=5,
+                 native_stream=True):
         self.move_speed = move_speed
         self.turn_speed = turn_speed
         # Create addresses
@@ -20,12 +26,58 @@ class Car:
         self.control_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
         self.control_socket.settimeout(time_out)
         self.control_socket.connect(control_addr)
-        self.camera_stream = cv2.VideoCapture(camera_addr)
+        # The native client hands over JPEG data, decoded only by the stages that use a frame
+        self.native_stream = native_stream
+        if native_stream:
+            self.camera_stream = MjpegStream(camera_addr, camera_time_out)
+        else:
+            self.camera_stream = cv2.VideoCapture(camera_addr)
+        # Drain the stream on a grabber thread, so frames never queue up in the capture buffer
+        self.camera_time_out = camera_time_out
+        self.frame_condition = Condition()
+        self.frame = (True, None, 0.0)
+        self.frame_index = 0
+        self.read_index = 0
+        self.skipped_frames = 0
+        self.grabbing = True
+        self.grabber = Thread(target=self.grab, daemon=True)
+        self.grabber.start()
         # Create action map
         self.action_map = [self.turn_left, self.turn_right, self.forward]
 
-    def read_camera(self):
-        return self.camera_stream.read()
+    def grab(self):
+        while self.grabbing:
+            if self.native_stream:
+                try:
+                    ret, frame = True, bytes(self.camera_stream.read_jpeg())
+                except (OSError, EOFError):
+                    ret, frame = False, None
+            else:
+                ret, frame = self.camera_stream.read()
+            with self.frame_condition:
+                self.frame = (ret, frame, time.time())
+                self.frame_index += 1
+                self.frame_condition.notify_all()
+            if not ret:
+                break
+
+    def read_frame_timed(self):
+        """
+        Wait for a frame newer than the last one read, older frames are skipped and counted
+        in skipped_frames. Frames of the native stream are returned as JPEG data.
+        :return: whether a frame is read, the frame, the time it was received
+        """
+        with self.frame_condition:
+            if not self.frame_condition.wait_for(lambda: self.frame_index > self.read_index, self.camera_time_out):
+                return False, None, None
+            self.skipped_frames += self.frame_index - self.read_index - 1
+            self.read_index = self.frame_index
+            return self.frame
+
+    def close(self):
+        self.grabbing = False
+        self.grabber.join(self.camera_time_out)
+        self.camera_stream.release()
 
     def step(self, action):
         assert action in range(0, 3)
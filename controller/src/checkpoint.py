@@ -0,0 +1,83 @@
+import os
+import os.path
+import pickle
+from queue import Queue
+from threading import Thread
+
+
+class Checkpointer:
+
+    def __init__(self, filename):
+        """
+        Write training checkpoints on a background thread. Values are fetched by the training
+        thread, so a checkpoint is consistent while training goes on during the write.
+        :param filename: the checkpoint file
+        """
+        self.filename = filename
+        # At most one checkpoint waits, the trainer blocks only if writes fall behind
+        self.queue = Queue(1)
+        # The exception a write failed with
+        self.error = None
+        self.thread = Thread(target=self.writer, daemon=True)
+        self.thread.start()
+
+    def save(self, checkpoint: dict):
+        """
+        Queue a checkpoint to write.
+        :param checkpoint: variable values and training state, see CNN.fit()
+        :raise IOError: if a previous checkpoint failed to write
+        """
+        self.check()
+        self.queue.put(checkpoint)
+
+    def writer(self):
+        while True:
+            checkpoint = self.queue.get()
+            if checkpoint is None:
+                return
+            # Keep taking checkpoints after a failure, so save() never waits for the queue
+            if self.error is not None:
+                continue
+            try:
+                directory = os.path.dirname(self.filename)
+                if directory:
+                    os.makedirs(directory, exist_ok=True)
+                # Replace atomically, so a crash during the write keeps the previous checkpoint
+                temp_file = self.filename + '.tmp'
+                with open(temp_file, 'wb') as file:
+                    pickle.dump(checkpoint, file, pickle.HIGHEST_PROTOCOL)
+                os.replace(temp_file, self.filename)
+            except Exception as e:
+                self.error = e
+
+    def check(self):
+        if self.error is not None:
+            raise IOError('Writing the checkpoint failed: %s' % self.error) from self.error
+
+    def close(self):
+        """
+        Wait for queued checkpoints to be written.
+        :raise IOError: if a checkpoint failed to write
+        """
+        if self.thread.is_alive():
+            self.queue.put(None)
+            self.thread.join()
+        self.check()
+
+    def remove(self):
+        """
+        Remove the checkpoint, once training has completed.
+        """
+        self.close()
+        if os.path.isfile(self.filename):
+            os.remove(self.filename)
+
+    @staticmethod
+    def load(filename):
+        """
+        :return: the checkpoint written to a file, None if there is none
+        """
+        if filename is None or not os.path.isfile(filename):
+            return None
+        with open(filename, 'rb') as file:
+            return pickle.load(file)
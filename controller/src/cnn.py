@@ -1,23 +1,61 @@
 import math
 import os.path
 import os.path
+import time
 
 import numpy as np
 import tensorflow as tf
 
+from checkpoint import Checkpointer
+from dataset import BalancedSampler, BatchSampler
+from loader import Prefetcher
+
+
+def session_config(intra_threads=0, inter_threads=0) -> tf.ConfigProto:
+    """
+    :param intra_threads: threads running a single operation, 0 for the default of TensorFlow
+    :param inter_threads: threads running independent operations, 0 for the default of TensorFlow
+    :return: the configuration of a session with these thread pools
+    """
+    # Inter-op threads are shared by all sessions of a process unless every session has its own
+    return tf.ConfigProto(intra_op_parallelism_threads=intra_threads, inter_op_parallelism_threads=inter_threads,
+                          use_per_session_threads=True)
+
 
 class CNN:
 
-    def __init__(self, input_shape: list, learning_rate=1e-3, model_file=None):
+    def __init__(self, input_shape: list, learning_rate=1e-3, model_file=None, input_scale=1.0,
+                 session_config=None, inference_config=None):
         """
         Create a PilotNet.
+        :param input_shape: the shape of input images
         :param learning_rate: learning rate for Adam optimizer
+        :param model_file: the checkpoint to restore
+        :param input_scale: the factor pixels are multiplied by, models trained so far use 1.0
+        :param session_config: the tf.ConfigProto of the training session, None for the default
+        :param inference_config: the tf.ConfigProto of the inference session, None for the default
         """
-        # Placeholders
-        self.input_image = tf.placeholder(tf.float32, [None] + input_shape)
+        # The model has a graph of its own, it does not share the default graph with other models
+        self.graph = tf.Graph()
+        with self.graph.as_default():
+            self.build(input_shape, learning_rate, input_scale)
+        # Training and inference run in separate sessions with separate thread pools, so training
+        # does not slow down steering. The inference session has its own copy of the weights,
+        # which is updated when training completes.
+        self.sess = tf.Session(graph=self.graph, config=session_config)
+        self.inference_sess = tf.Session(graph=self.graph, config=inference_config)
+        self.initialize()
+        self.load(model_file)
+
+    def build(self, input_shape: list, learning_rate, input_scale):
+        # Placeholders, images are fed as uint8 and cast in the graph
+        self.input_image = tf.placeholder(tf.uint8, [None] + input_shape)
         self.input_label = tf.placeholder(tf.int64, [None])
+        image = tf.cast(self.input_image, tf.float32)
+        if input_scale != 1.0:
+            image = image * input_scale
         # Convolution neural network
-        conv1 = self.conv2d_norm_relu(self.input_image, filters=32, kernel_size=7, strides=2, activation=tf.nn.relu)
+        conv1 = self.conv2d_norm_relu(image, filters=32, kernel_size=7, strides=2, activation=tf.nn.relu)
         conv2 = self.conv2d_norm_relu(conv1, filters=64, kernel_size=5, strides=2, activation=tf.nn.relu)
         conv3 = self.conv2d_norm_relu(conv2, filters=64, kernel_size=3, strides=1, activation=tf.nn.relu)
         flat = tf.layers.flatten(conv3)
@@ -37,67 +75,154 @@ class CNN:
         self.loss = tf.losses.softmax_cross_entropy(tf.one_hot(self.input_label, 3), logits)
         optimizer = tf.train.AdamOptimizer(learning_rate)
         self.train_step = optimizer.minimize(self.loss)
-        # Create session
-        self.sess = tf.Session()
-        self.initialize()
-        self.load(model_file)
+        # Weights and optimizer state, saved in training checkpoints
+        self.variables = tf.global_variables()
+        self.init_op = tf.global_variables_initializer()
+        self.saver = tf.train.Saver()
 
     def initialize(self):
-        self.sess.run(tf.global_variables_initializer())
+        self.sess.run(self.init_op)
+        self.inference_sess.run(self.init_op)
 
-    def fit(self, train_image: np.ndarray, train_label: np.ndarray,
-            val_image: np.ndarray, val_label: np.ndarray, batch_size=100, print_iters=100, iters=1000, report_func=None) -> dict:
+    def fit(self, train_image, train_label: np.ndarray,
+            val_image, val_label: np.ndarray, batch_size=100, print_iters=100, iters=1000, report_func=None, mirror=False, balanced=False,
+            prefetch_depth=4, prefetch_workers=2, checkpoint_file=None, checkpoint_iters=1000, random_seed=None,
+            val_size=1000, final_eval=True, data_id=None) -> dict:
         """
         Fit model.
-        :param train_image: images of training data set
+        :param train_image: images of training data set, an array or a lazy view supporting len() and indexing
         :param train_label: labels of training data set
-        :param val_image: images of validation data set
+        :param val_image: images of validation data set, an array or a lazy view
         :param val_label: labels of validation data set
         :param batch_size: training batch size
         :param print_iters: print cost value every n iters
         :param iters: training iterations in each epoch
-        :return: training history
+        :param mirror: whether to mirror half of each training batch
+        :param balanced: whether to sample every action equally often
+        :param prefetch_depth: the number of batches prepared ahead
+        :param prefetch_workers: the number of threads preparing batches
+        :param checkpoint_file: the file training is checkpointed to every checkpoint_iters and resumed
+                                from, it is removed once training completes
+        :param checkpoint_iters: iterations between checkpoints
+        :param random_seed: the seed of batch sampling, None for a random seed
+        :param val_size: the number of validation frames evaluated every print_iters, the subsample
+                         rotates through the validation set
+        :param final_eval: whether to evaluate the whole training and validation set after training
+        :param data_id: identifies the training data, e.g. the content hash of the data set and the
+                        selected sessions, a checkpoint of other data is not resumed
+        :return: training history, including seconds each step waited for input and computed. train_acc
+                 is the running accuracy of the last print_iters batches and val_acc the accuracy of
+                 the validation subsample, final_train_acc and final_val_acc are exact
         """
         history = {
             'loss': [],
+            'batch_acc': [],
             'train_acc': [],
-            'val_acc': []
+            'val_acc': [],
+            'eval_iters': [],
+            'input_time': [],
+            'compute_time': [],
+            'final_train_acc': None,
+            'final_val_acc': None
         }
-        for i in range(iters):
-            # Generate batch
-            batch_index = np.random.choice(len(train_image), batch_size)
-            batch_image = train_image[batch_index]
-            batch_label = train_label[batch_index]
-            # Train model
-            loss, _ = self.sess.run([self.loss, self.train_step], {
-                self.input_image: batch_image,
-                self.input_label: batch_label
-            })
-            history['loss'].append(loss)
-            # Print loss
-            if (i + 1) % print_iters == 0:
-                print('iter %d/%d, loss = %f' % (i+1, iters, loss))
-                # Calculate accuracy
-                train_acc = self.check_accuracy(train_image, train_label)
-                val_acc = self.check_accuracy(val_image, val_label)
-                history['train_acc'].append(train_acc)
-                history['val_acc'].append(val_acc)
-                # Call report function
-                if report_func:
-                    report_func(i, history)
+        # Every report validates the next val_size frames of a fixed shuffle
+        val_order = np.random.RandomState(0).permutation(len(val_label))
+        val_size = min(val_size, len(val_label))
+        sampler_class = BalancedSampler if balanced else BatchSampler
+        sampler = sampler_class(train_image, train_label, batch_size, mirror=mirror, random_seed=random_seed)
+        # Resume an interrupted run with the same data and options
+        setting = {'data_id': data_id, 'num_train': len(train_label), 'batch_size': batch_size,
+                   'mirror': mirror, 'balanced': balanced}
+        start_iter = 0
+        checkpoint = Checkpointer.load(checkpoint_file)
+        if checkpoint is not None and checkpoint['setting'] == setting:
+            self.set_variables(checkpoint['variables'])
+            sampler.set_state(checkpoint['sampler'])
+            history = checkpoint['history']
+            start_iter = checkpoint['iteration']
+            print('resume from iter %d' % start_iter)
+        elif checkpoint is not None:
+            print('checkpoint %s is of other data or options, not resumed' % checkpoint_file)
+        checkpointer = Checkpointer(checkpoint_file) if checkpoint_file else None
+        prefetcher = Prefetcher(sampler, prefetch_depth, prefetch_workers)
+        completed = False
+        try:
+            for i in range(start_iter, iters):
+                # Generate batch
+                batch_image, batch_label, input_time = prefetcher.next()
+                # Train model
+                start = time.time()
+                loss, batch_acc, _ = self.sess.run([self.loss, self.output_acc, self.train_step], {
+                    self.input_image: batch_image,
+                    self.input_label: batch_label
+                })
+                history['loss'].append(loss)
+                history['batch_acc'].append(batch_acc)
+                history['input_time'].append(input_time)
+                history['compute_time'].append(time.time() - start)
+                # Print loss
+                if (i + 1) % print_iters == 0:
+                    input_time = np.sum(history['input_time'][-print_iters:])
+                    compute_time = np.sum(history['compute_time'][-print_iters:])
+                    print('iter %d/%d, epoch %d, loss = %f, input wait = %.3fs, compute = %.3fs' %
+                          (i+1, iters, prefetcher.state['epoch'], loss, input_time, compute_time))
+                    # Estimate accuracy from training batches and a validation subsample
+                    val_start = len(history['val_acc']) * val_size % max(len(val_label), 1)
+                    val_index = np.sort(np.roll(val_order, -val_start)[:val_size])
+                    train_acc = np.mean(history['batch_acc'][-print_iters:])
+                    val_acc = self.check_accuracy(val_image[val_index], val_label[val_index])
+                    history['train_acc'].append(train_acc)
+                    history['val_acc'].append(val_acc)
+                    history['eval_iters'].append(i + 1)
+                    # Call report function
+                    if report_func:
+                        report_func(i, history)
+                # Checkpoint, values are fetched here and written in the background
+                if checkpointer and (i + 1) % checkpoint_iters == 0 and i + 1 < iters:
+                    checkpointer.save({
+                        'setting': setting,
+                        'iteration': i + 1,
+                        'variables': self.get_variables(),
+                        'sampler': prefetcher.state,
+                        'history': {key: list(value) if isinstance(value, list) else value
+                                    for key, value in history.items()}
+                    })
+            completed = True
+        finally:
+            prefetcher.close()
+            if checkpointer and completed:
+                checkpointer.remove()
+            elif checkpointer:
+                checkpointer.close()
+        # Steer with the trained weights
+        self.set_variables(self.get_variables(), self.inference_sess)
+        # Exact accuracy, beside the last estimates
+        if final_eval:
+            history['final_train_acc'] = self.check_accuracy(train_image, train_label)
+            history['final_val_acc'] = self.check_accuracy(val_image, val_label)
+            print('final train acc = %f (estimated %f), val acc = %f (estimated %f)' % (
+                history['final_train_acc'], history['train_acc'][-1] if history['train_acc'] else np.nan,
+                history['final_val_acc'], history['val_acc'][-1] if history['val_acc'] else np.nan))
         return history
 
     def predict(self, image) -> tuple:
         """
         Predict direction according road image.
-        :param sess: computation session
         :param image: road image
         :return: predicted direction, salient map
         """
-        directions, masks = self.sess.run([self.output_softmax, self.output_masks], {self.input_image: image})
+        directions, masks = self.inference_sess.run([self.output_softmax, self.output_masks], {self.input_image: image})
         return directions, masks
 
-    def check_accuracy(self, image: np.ndarray, label: np.ndarray, batch_size=100) -> float:
+    def predict_proba(self, image) -> np.ndarray:
+        """
+        Predict direction according road image, without evaluating the salient map.
+        :param image: road image
+        :return: predicted direction
+        """
+        return self.inference_sess.run(self.output_softmax, {self.input_image: image})
+
+    def check_accuracy(self, image, label: np.ndarray, batch_size=100) -> float:
         """
         Check accuracy of data set (image, label).
         :param image: images of data set
@@ -119,13 +244,27 @@ class CNN:
             batch_weight.append(len(batch_images))
         return np.average(batch_accs, weights=batch_weight)
 
+    def get_variables(self) -> dict:
+        """
+        :return: values of weights and optimizer state by name
+        """
+        return dict(zip([variable.name for variable in self.variables], self.sess.run(self.variables)))
+
+    def set_variables(self, values: dict, session=None):
+        """
+        Assign values returned by get_variables().
+        :param values: values by name
+        :param session: the session to assign in, the training session by default
+        """
+        for variable in self.variables:
+            variable.load(values[variable.name], session or self.sess)
+
     def save(self, filename):
         """
         Save parameters to files.
         :param filename: file name
         """
-        saver = tf.train.Saver()
-        saver.save(self.sess, filename)
+        self.saver.save(self.sess, filename)
 
     def load(self, filename):
         """
@@ -136,8 +275,8 @@ class CNN:
             return
         if not os.path.isfile(filename + '.meta'):
             return
-        saver = tf.train.Saver()
-        saver.restore(self.sess, filename)
+        self.saver.restore(self.sess, filename)
+        self.saver.restore(self.inference_sess, filename)
 
     @staticmethod
     def conv2d_norm_relu(inputs, filters, kernel_size, strides, activation):
@@ -3,8 +3,37 @@ import cv2
 image_dir = '../photo/'
 video_dir = '../video/'
 
+data_dir = '../dataset/'
+# Pickled data set of older versions, migrated into data_dir on first open
 data_file = '../dataset.dat'
+# Encoding of recorded observations, 'raw', 'png' or 'jpeg' (see bench_storage.py)
+data_encoding = 'raw'
+# JPEG quality (0-100) or PNG compression level (0-9), None for the default
+data_quality = None
+# Frames flushed to the data set at a time while recording
+record_chunk_size = 256
+# Drop recorded frames within this hash distance of recent frames, None to keep all
+dedup_distance = 4
+# The number of recent frames compared with
+dedup_window = 256
+# Keep one in every n near-duplicates instead of dropping all, 0 to drop all
+dedup_keep_every = 0
+# Tags of recorded sessions
+data_tags = {'car': 'virtual'}
+# Tags of sessions used for training and exploring, e.g. {'car': 'real'}, empty for all
+data_filter = {}
 model_file = '../model/driver.ckpt'
+# Training is checkpointed every checkpoint_iters iterations and an interrupted run resumes from it
+checkpoint_file = '../model/train.ckpt.pkl'
+checkpoint_iters = 1000
+# Weights of model_file exported for the NumPy inference engine
+engine_file = '../model/driver.npz'
+# Weights of engine_file quantized to int8 by quantize.py
+int8_file = '../model/driver.int8.npz'
+# Thread pools (intra-op, inter-op) of the training and inference sessions, 0 for the default
+# of TensorFlow. Inference is kept small to leave cores to training and the user interface.
+train_threads = (0, 0)
+inference_threads = (2, 1)
 
 url_github = 'https://github.com/ZhangZhenghao/GrandRaspberryAuto'
 url_stream = 'http://192.168.1.1:8080/?action=stream'
@@ -20,10 +49,18 @@ stream_height = 240
 stream_width = 320
 stream_fps = 30
 stream_channel = 3
+# Parse the camera stream natively instead of by cv2.VideoCapture, frames are then only decoded
+# when used, and the observation is decoded at reduced scale when the geometry allows it
+stream_native = True
 
 observation_height = 60
 observation_width = 160
 observation_channel = 3
 
+# Compute the salient map every n frames when it is displayed
+salient_interval = 5
+# Rendered frames waiting to be written to a video, more are dropped
+video_queue_size = 30
+
 move_speed = 30
 turn_speed = 60
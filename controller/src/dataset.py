@@ -1,63 +1,954 @@
+import copy
+import hashlib
+import json
 import os
 import os.path
 import pickle
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from functools import partial
+from queue import Queue
+from threading import Lock, RLock, Thread
 
+import cv2
 import numpy as np
 
+try:
+    import fcntl
+except ImportError:
+    # No file locks on Windows, only DataFiles of the same process exclude each other
+    fcntl = None
+
+NUM_ACTIONS = 3
+# Action of the mirrored frame, indexed by action (left <-> right, forward stays)
+MIRROR_ACTION = np.array([1, 0, 2])
+# Image formats of compressed chunks
+ENCODING_EXTENSIONS = {'png': '.png', 'jpeg': '.jpg'}
+# Threads encoding and decoding compressed chunks
+CODEC_WORKERS = os.cpu_count() or 1
+codec_pool = None
+
+
+def get_codec_pool() -> ThreadPoolExecutor:
+    global codec_pool
+    if codec_pool is None:
+        codec_pool = ThreadPoolExecutor(CODEC_WORKERS)
+    return codec_pool
+
+
+class DirectoryLock:
+
+    def __init__(self, path):
+        """
+        Lock a data set against changes by other threads and processes. The lock is
+        reentrant within a thread, the lock file is only locked by the outermost holder.
+        :param path: the lock file
+        """
+        self.path = path
+        self.lock = RLock()
+        self.depth = 0
+        self.file = None
+
+    def __enter__(self):
+        self.lock.acquire()
+        self.depth += 1
+        if self.depth == 1 and fcntl is not None:
+            try:
+                self.file = open(self.path, 'a')
+                fcntl.flock(self.file, fcntl.LOCK_EX)
+            except BaseException:
+                self.__exit__(None, None, None)
+                raise
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.depth -= 1
+        if self.depth == 0 and self.file is not None:
+            # Closing the file releases the file lock
+            self.file.close()
+            self.file = None
+        self.lock.release()
+
+
+# Locks of data set directories, shared by every DataFile of the process
+directory_locks = {}
+directory_locks_lock = Lock()
+
+
+def get_directory_lock(data_dir) -> DirectoryLock:
+    path = os.path.realpath(data_dir)
+    with directory_locks_lock:
+        if path not in directory_locks:
+            directory_locks[path] = DirectoryLock(os.path.join(path, DataFile.LOCK_FILE))
+        return directory_locks[path]
+
 
 class DataFile:
 
-    def __init__(self, data_file):
-        self.data_file = data_file
-        # Create file if not existed
-        if not os.path.exists(data_file):
-            data = {'observation': [], 'action': []}
-            with open(data_file, 'wb') as file:
-                pickle.dump(data, file)
-        # Load data
-        with open(self.data_file, 'rb') as file:
-            self.data = pickle.load(file)
+    INDEX_FILE = 'index.json'
+    HEADER_FILE = 'header.json'
+    LOCK_FILE = 'index.lock'
+    VERSION = 3
+    # Frames per chunk when migrating a legacy data set
+    MIGRATE_CHUNK_SIZE = 4096
+
+    def __init__(self, data_dir, legacy_file=None, encoding='raw', quality=None):
+        """
+        Open a chunked data set. Every append writes a new chunk and a small index,
+        so the cost of an append only depends on the size of the appended data.
+        Removed frames are marked in a tombstone bitmap beside their chunk and are
+        dropped from disk by compact().
+        The index is also a catalog of recording sessions: every chunk belongs to a
+        session and carries its frame count and action histogram, so subsets can be
+        selected and counted without reading any image.
+        A small header with the frame count, shape, action histogram and content hash
+        of the data set is kept beside the index, see read_header().
+        Several DataFiles, also in other processes, may write the same data set: every
+        change reloads the index under a file lock, and chunks get names that never
+        collide. Reads see the data set as of the last reload.
+        :param data_dir: the directory of the data set
+        :param legacy_file: the pickled data set to migrate from, if not migrated yet
+        :param encoding: the encoding of observations in new chunks, 'raw', 'png' or 'jpeg'
+        :param quality: the JPEG quality (0-100) or PNG compression level (0-9) of new chunks
+        """
+        assert encoding == 'raw' or encoding in ENCODING_EXTENSIONS
+        self.data_dir = data_dir
+        self.encoding = encoding
+        self.quality = quality
+        self.index_file = os.path.join(data_dir, self.INDEX_FILE)
+        self.header_file = os.path.join(data_dir, self.HEADER_FILE)
+        os.makedirs(data_dir, exist_ok=True)
+        self.lock = get_directory_lock(data_dir)
+        # Selected sessions, None for all sessions
+        self.sessions = None
+        with self.lock:
+            if not os.path.exists(self.index_file):
+                # Create data set if not existed, next_chunk is only kept for older versions
+                self.index = {'version': self.VERSION, 'uuid': uuid.uuid4().hex, 'shape': None,
+                              'next_chunk': 0, 'chunks': [],
+                              'next_session': 0, 'sessions': []}
+                if legacy_file is not None and os.path.exists(legacy_file):
+                    self.migrate(legacy_file)
+                self.save_index()
+            self.reload()
+            # Repair the header if a crash left it stale
+            if self.read_header(data_dir) != self.header():
+                self.save_header()
 
     def __len__(self):
-        assert len(self.data['action']) == len(self.data['observation'])
-        return len(self.data['observation'])
+        return sum(chunk['count'] for chunk in self.chunks()) - \
+               sum(int(np.count_nonzero(self.tombstones[chunk['name']]))
+                   for chunk in self.chunks() if chunk['name'] in self.tombstones)
+
+    @property
+    def observation(self):
+        """
+        All observations in the selected sessions, memory-mapped from the chunks.
+        """
+        chunks = self.chunks()
+        observation = ChunkedArray([partial(self.load_chunk, chunk) for chunk in chunks],
+                                   [chunk['count'] for chunk in chunks],
+                                   self.index['shape'] or [])
+        if not any(chunk['name'] in self.tombstones for chunk in chunks):
+            return observation
+        return IndexedArray(observation, self.live_index())
+
+    @property
+    def action(self) -> np.ndarray:
+        """
+        All actions in the selected sessions.
+        """
+        chunks = self.chunks()
+        if len(chunks) == 0:
+            return np.zeros([0], np.int64)
+        action = np.concatenate([np.load(self.chunk_path(chunk, 'act')) for chunk in chunks])
+        if not any(chunk['name'] in self.tombstones for chunk in chunks):
+            return action
+        return action[self.live_index()]
+
+    def chunks(self) -> list:
+        """
+        Index entries of chunks in the selected sessions.
+        """
+        if self.sessions is None:
+            return self.index['chunks']
+        return [chunk for chunk in self.index['chunks'] if chunk['session'] in self.sessions]
+
+    def live_index(self) -> np.ndarray:
+        """
+        Positions of frames not removed, among all frames stored in selected chunks.
+        """
+        live = [np.logical_not(self.tombstones[chunk['name']]) if chunk['name'] in self.tombstones
+                else np.ones(chunk['count'], np.bool_) for chunk in self.chunks()]
+        return np.flatnonzero(np.concatenate(live)) if len(live) > 0 else np.zeros([0], np.int64)
+
+    def histogram(self) -> np.ndarray:
+        """
+        Count frames of each action in the selected sessions.
+        :return: the number of frames of each action
+        """
+        histogram = np.zeros(NUM_ACTIONS, np.int64)
+        for chunk in self.chunks():
+            histogram += chunk['histogram']
+            if chunk['name'] in self.tombstones:
+                action = np.load(self.chunk_path(chunk, 'act'))
+                histogram -= np.bincount(action[self.tombstones[chunk['name']]], minlength=NUM_ACTIONS)
+        return histogram
+
+    def header(self) -> dict:
+        """
+        Describe the whole data set, ignoring any selection.
+        :return: the version, frame count, shape, dtype, action histogram and content hash
+        """
+        whole = copy.copy(self)
+        whole.sessions = None
+        return {
+            'version': self.VERSION,
+            'count': len(whole),
+            'shape': self.index['shape'],
+            'dtype': 'uint8',
+            'histogram': whole.histogram().tolist(),
+            'hash': self.content_hash()
+        }
+
+    def content_hash(self) -> str:
+        """
+        Hash of the content of the data set. Chunks are never modified once written,
+        so the names of chunks and their tombstones identify the content.
+        """
+        digest = hashlib.sha1(self.index['uuid'].encode())
+        for chunk in self.index['chunks']:
+            digest.update(chunk['name'].encode())
+            if chunk['name'] in self.tombstones:
+                digest.update(np.packbits(self.tombstones[chunk['name']]).tobytes())
+        return digest.hexdigest()
+
+    @staticmethod
+    def read_header(data_dir):
+        """
+        Read the header of a data set without opening it.
+        :param data_dir: the directory of the data set
+        :return: the header, see header(), or None if not existed
+        """
+        header_file = os.path.join(data_dir, DataFile.HEADER_FILE)
+        if not os.path.exists(header_file):
+            return None
+        with open(header_file, 'r') as file:
+            return json.load(file)
+
+    def catalog(self) -> list:
+        """
+        Summarize recording sessions from the index, removed frames not compacted
+        yet are still counted.
+        :return: sessions with their frame count and action histogram
+        """
+        summary = {session['id']: dict(session, count=0, histogram=[0] * NUM_ACTIONS)
+                   for session in self.index['sessions']}
+        for chunk in self.index['chunks']:
+            entry = summary[chunk['session']]
+            entry['count'] += chunk['count']
+            entry['histogram'] = [a + b for a, b in zip(entry['histogram'], chunk['histogram'])]
+        return list(summary.values())
+
+    def select(self, sessions=None, since=None, until=None, **tags):
+        """
+        Select a subset of sessions. The returned data set shares storage with this
+        one, only chunks of the selected sessions are read.
+        :param sessions: ids of sessions, None for all
+        :param since: the earliest recording time in ISO format
+        :param until: the latest recording time in ISO format
+        :param tags: tags every selected session should have, e.g. car='virtual'
+        :return: the selected data set
+        """
+        selected = copy.copy(self)
+        selected.sessions = set()
+        for session in self.index['sessions']:
+            if sessions is not None and session['id'] not in sessions:
+                continue
+            if since is not None and (session['time'] is None or session['time'] < since):
+                continue
+            if until is not None and (session['time'] is None or session['time'] > until):
+                continue
+            if any(session['tags'].get(key) != value for key, value in tags.items()):
+                continue
+            selected.sessions.add(session['id'])
+        return selected
 
-    def append(self, observation, action):
-        self.data['action'] += action
-        self.data['observation'] += observation
-        with open(self.data_file, 'wb') as file:
-            pickle.dump(self.data, file)
+    def new_session(self, **tags) -> int:
+        """
+        Start a recording session.
+        :param tags: tags of the session, e.g. car='virtual', track='bedroom'
+        :return: the id of the session
+        """
+        with self.lock:
+            self.reload()
+            session = {'id': self.index['next_session'],
+                       'time': datetime.now().isoformat(timespec='seconds'),
+                       'tags': tags}
+            self.index['next_session'] += 1
+            self.index['sessions'].append(session)
+            self.save_index()
+            return session['id']
+
+    def append(self, observation, action, session=None):
+        """
+        Append frames to the data set as a new chunk.
+        :param observation: observations of frames
+        :param action: actions of frames
+        :param session: the session of frames, a new session is started if None
+        """
+        assert len(observation) == len(action)
+        if len(action) == 0:
+            return
+        with self.lock:
+            self.reload()
+            if session is None:
+                session = self.new_session()
+            self.index['chunks'].append(self.write_chunk(observation, action, session))
+            self.save_index()
+            self.save_header()
 
     def remove(self, index):
-        assert 0 <= index <= len(self.data["observation"])
-        del self.data["observation"][index]
-        del self.data["action"][index]
-        with open(self.data_file, 'wb') as file:
-            pickle.dump(self.data, file)
-
-    def gen_train_set(self, test_size=0.3, mirror=True, random_seed=0):
-        observations = np.asarray(self.data['observation'])
-        actions = np.asarray(self.data['action'])
+        """
+        Remove a frame from the selected sessions. Only the tombstone bitmap of its
+        chunk is written, the frame stays on disk until compact().
+        :param index: the index of the frame
+        """
+        with self.lock:
+            # Other writers append chunks or compact them, neither moves the frames before
+            self.reload()
+            assert 0 <= index < len(self)
+            position = self.live_index()[index]
+            for chunk in self.chunks():
+                if position < chunk['count']:
+                    break
+                position -= chunk['count']
+            tombstone = self.tombstones.setdefault(chunk['name'], np.zeros(chunk['count'], np.bool_))
+            tombstone[position] = True
+            temp_file = self.chunk_path(chunk, 'del') + '.tmp'
+            with open(temp_file, 'wb') as file:
+                np.save(file, np.packbits(tombstone))
+            os.replace(temp_file, self.chunk_path(chunk, 'del'))
+            self.save_header()
+
+    def compact(self):
+        """
+        Rewrite chunks containing removed frames without them. Chunks are rewritten
+        without holding the lock, so other writers are only blocked while the index
+        is swapped.
+        """
+        with self.lock:
+            self.reload()
+            tombstoned = [(chunk, self.tombstones[chunk['name']].copy())
+                          for chunk in self.index['chunks'] if chunk['name'] in self.tombstones]
+        if len(tombstoned) == 0:
+            return
+        # Old chunks, their tombstones and the chunks replacing them, None if no frame is kept
+        rewritten = []
+        for chunk, tombstone in tombstoned:
+            keep = np.logical_not(tombstone)
+            if not np.any(keep):
+                rewritten.append((chunk, tombstone, None))
+                continue
+            try:
+                observation, action = self.load_chunk(chunk), np.load(self.chunk_path(chunk, 'act'))
+            except FileNotFoundError:
+                # Compacted by another writer meanwhile
+                continue
+            # Compressed images are copied without decoding
+            if isinstance(observation, EncodedChunk):
+                observation = observation.subset(np.flatnonzero(keep))
+            else:
+                observation = observation[keep]
+            rewritten.append((chunk, tombstone, self.write_chunk(observation, action[keep], chunk['session'],
+                                                                 chunk.get('encoding', 'raw'), chunk.get('quality'))))
+        with self.lock:
+            self.reload()
+            positions = {chunk['name']: i for i, chunk in enumerate(self.index['chunks'])}
+            compacted = []
+            for chunk, tombstone, new_chunk in rewritten:
+                current = self.tombstones.get(chunk['name'])
+                if chunk['name'] in positions and current is not None and np.array_equal(current, tombstone):
+                    self.index['chunks'][positions[chunk['name']]] = new_chunk
+                    compacted.append(chunk)
+                elif new_chunk is not None:
+                    # Another writer compacted the chunk or removed more frames meanwhile
+                    self.delete_chunk(new_chunk)
+            self.index['chunks'] = [chunk for chunk in self.index['chunks'] if chunk is not None]
+            self.save_index()
+            for chunk in compacted:
+                self.delete_chunk(chunk)
+                del self.tombstones[chunk['name']]
+            self.save_header()
+
+    def compact_async(self) -> Thread:
+        """
+        Run compact() in a background thread.
+        :return: the started thread
+        """
+        thread = Thread(target=self.compact)
+        thread.start()
+        return thread
+
+    def migrate(self, legacy_file):
+        """
+        Import a data set pickled as {'observation': [...], 'action': [...]}.
+        :param legacy_file: the pickled data set
+        """
+        with open(legacy_file, 'rb') as file:
+            data = pickle.load(file)
+        assert len(data['observation']) == len(data['action'])
+        session = {'id': self.index['next_session'], 'time': None, 'tags': {'source': 'legacy'}}
+        self.index['next_session'] += 1
+        self.index['sessions'].append(session)
+        for i in range(0, len(data['action']), self.MIGRATE_CHUNK_SIZE):
+            observation = data['observation'][i:i+self.MIGRATE_CHUNK_SIZE]
+            action = data['action'][i:i+self.MIGRATE_CHUNK_SIZE]
+            self.index['chunks'].append(self.write_chunk(observation, action, session['id']))
+
+    def upgrade(self):
+        """
+        Upgrade the index of an older version in place.
+        """
+        if self.index['version'] < 2:
+            # Put chunks without session into a single session
+            session = {'id': 0, 'time': None, 'tags': {}}
+            self.index['next_session'] = 1
+            self.index['sessions'] = [session]
+            for chunk in self.index['chunks']:
+                chunk['session'] = session['id']
+                action = np.load(self.chunk_path(chunk, 'act'))
+                chunk['histogram'] = np.bincount(action, minlength=NUM_ACTIONS).tolist()
+        if self.index['version'] < 3:
+            self.index['uuid'] = uuid.uuid4().hex
+        self.index['version'] = self.VERSION
+        self.save_index()
+
+    def reload(self):
+        """
+        Read the index and tombstones as written by any DataFile. Call with the lock held.
+        """
+        with open(self.index_file, 'r') as file:
+            self.index = json.load(file)
+        if self.index['version'] < self.VERSION:
+            self.upgrade()
+        self.tombstones = {}
+        file_names = set(os.listdir(self.data_dir))
+        for chunk in self.index['chunks']:
+            path = self.chunk_path(chunk, 'del')
+            if os.path.basename(path) in file_names:
+                self.tombstones[chunk['name']] = np.unpackbits(np.load(path), count=chunk['count']).astype(np.bool_)
+
+    def write_chunk(self, observation, action, session, encoding=None, quality=None) -> dict:
+        """
+        Write a chunk under a random name, so chunks written by several DataFiles never
+        collide and existing chunks are never overwritten.
+        :param observation: observations of the chunk, or an EncodedChunk of the same encoding
+        :param action: actions of the chunk
+        :param session: the session of the chunk
+        :param encoding: the encoding of observations, the encoding of the data set if None
+        :param quality: the quality of the encoding
+        :return: the index entry of the chunk
+        """
+        if encoding is None:
+            encoding, quality = self.encoding, self.quality
+        if not isinstance(observation, EncodedChunk):
+            observation = np.asarray(observation, np.uint8)
+        action = np.asarray(action, np.int64)
+        if self.index['shape'] is None:
+            self.index['shape'] = list(observation.shape[1:])
+        assert list(observation.shape[1:]) == self.index['shape']
+        chunk = {'name': uuid.uuid4().hex,
+                 'session': session,
+                 'count': len(action),
+                 'histogram': np.bincount(action, minlength=NUM_ACTIONS).tolist()}
+        if encoding == 'raw':
+            np.save(self.chunk_path(chunk, 'obs'), observation)
+        else:
+            chunk['encoding'] = encoding
+            chunk['quality'] = quality
+            if not isinstance(observation, EncodedChunk):
+                observation = EncodedChunk.encode(observation, encoding, quality)
+            observation.save(self.chunk_path(chunk, 'enc'), self.chunk_path(chunk, 'off'))
+        np.save(self.chunk_path(chunk, 'act'), action)
+        return chunk
+
+    def load_chunk(self, chunk):
+        """
+        Open observations of a chunk without reading them.
+        :param chunk: the index entry of the chunk
+        :return: the memory-mapped array or the EncodedChunk
+        """
+        if chunk.get('encoding', 'raw') == 'raw':
+            return np.load(self.chunk_path(chunk, 'obs'), mmap_mode='r')
+        return EncodedChunk(np.load(self.chunk_path(chunk, 'enc'), mmap_mode='r'),
+                            np.load(self.chunk_path(chunk, 'off')), self.index['shape'])
+
+    def delete_chunk(self, chunk):
+        for kind in ['obs', 'enc', 'off', 'act', 'del']:
+            if os.path.exists(self.chunk_path(chunk, kind)):
+                os.remove(self.chunk_path(chunk, kind))
+
+    def chunk_path(self, chunk, kind) -> str:
+        return os.path.join(self.data_dir, '%s.%s.npy' % (chunk['name'], kind))
+
+    def save_index(self):
+        dump_json(self.index, self.index_file)
+
+    def save_header(self):
+        dump_json(self.header(), self.header_file)
+
+    def session_ids(self) -> np.ndarray:
+        """
+        Session of every frame in the selected sessions, read from the index only.
+        """
+        chunks = self.chunks()
+        if len(chunks) == 0:
+            return np.zeros([0], np.int64)
+        session = np.repeat([chunk['session'] for chunk in chunks], [chunk['count'] for chunk in chunks])
+        if not any(chunk['name'] in self.tombstones for chunk in chunks):
+            return session
+        return session[self.live_index()]
+
+    def gen_train_set(self, test_size=0.3, mirror=True, random_seed=0, by_session=False):
+        """
+        Split the data set into training and test set, stratified by action. Observations
+        are returned as views over the memory-mapped chunks, which are only read batch
+        by batch. Training frames are not mirrored here, use BatchSampler(mirror=True)
+        to flip them randomly per batch.
+        :param test_size: the fraction of test samples
+        :param mirror: whether to add the mirror of every test frame to the test set
+        :param random_seed: the seed of the split
+        :param by_session: whether to stratify by recording session as well
+        :return: train observations, train actions, test observations, test actions
+        """
+        observations = self.observation
+        actions = self.action
         assert len(observations) == len(actions)
-        # Data augmentation
-        if mirror:
-            mirror_observations = np.flip(observations, 2)
-            mirror_actions = np.zeros_like(actions)
-            num_total = len(actions)
-            for i in range(num_total):
-                # Mirror actions
-                if actions[i] == 2:
-                    mirror_actions[i] = 2
-                elif actions[i] == 0:
-                    mirror_actions[i] = 1
-                elif actions[i] == 1:
-                    mirror_actions[i] = 0
-            actions = np.concatenate([actions, mirror_actions])
-            observations = np.concatenate([observations, mirror_observations])
         # Train misc split
-        num_total = actions.shape[0]
-        num_test = int(num_total * test_size)
-        np.random.seed(random_seed)
-        index = np.random.permutation(num_total)
-        test_index, train_index = index[:num_test], index[num_test:]
-        return observations[train_index], actions[train_index], observations[test_index], actions[test_index]
+        train_index, test_index = split_index(actions, test_size, random_seed,
+                                              self.session_ids() if by_session else None)
+        test_flip = np.zeros(len(test_index), np.bool_)
+        test_actions = actions[test_index]
+        # Mirrored test frames only exist virtually
+        if mirror:
+            test_index = np.concatenate([test_index, test_index])
+            test_flip = np.concatenate([test_flip, np.logical_not(test_flip)])
+            test_actions = np.concatenate([test_actions, MIRROR_ACTION[test_actions]])
+        return IndexedArray(observations, train_index), actions[train_index], \
+            IndexedArray(observations, test_index, test_flip), test_actions
+
+    def copy_to(self, data_dir, encoding='raw', quality=None, frames=0, chunk_size=4096) -> 'DataFile':
+        """
+        Copy the selected sessions into a new data set, as a single session.
+        :param data_dir: the directory of the copy
+        :param encoding: the encoding of the copy
+        :param quality: the quality of the encoding
+        :param frames: the number of frames to copy, 0 for all
+        :param chunk_size: the number of frames in a chunk
+        :return: the copy
+        """
+        target = DataFile(data_dir, encoding=encoding, quality=quality)
+        observation, action = self.observation, self.action
+        if frames > 0:
+            action = action[:frames]
+        session = target.new_session()
+        for i in range(0, len(action), chunk_size):
+            end = min(i + chunk_size, len(action))
+            target.append(observation[i:end], action[i:end], session)
+        return target
+
+
+class Recorder:
+
+    def __init__(self, data_file: DataFile, chunk_size=256, max_chunks=2, tags=None, deduplicator=None):
+        """
+        Record frames into a data set. Every chunk_size frames are flushed as a chunk
+        by a background writer, so memory stays flat. A crash loses the frames not yet
+        written: the partial chunk, up to max_chunks queued chunks and the chunk being
+        written, at most (max_chunks + 2) * chunk_size - 1 frames. record() waits for
+        the writer only when max_chunks chunks are queued, no frame is dropped. A
+        failure of the writer is raised by the next record().
+        :param data_file: the data set to record into
+        :param chunk_size: the number of frames in a chunk
+        :param max_chunks: the number of full chunks waiting for the writer
+        :param tags: tags of the recording session
+        :param deduplicator: the Deduplicator filtering frames before they are written, seeded
+                             with the last frames of the data set
+        """
+        self.data_file = data_file
+        self.deduplicator = deduplicator
+        self.session = data_file.new_session(**(tags or {}))
+        self.chunk_size = chunk_size
+        self.observation = None
+        self.action = []
+        self.closed = False
+        # The exception that stopped the writer
+        self.error = None
+        self.lock = Lock()
+        self.queue = Queue(max_chunks)
+        self.thread = Thread(target=self.writer)
+        self.thread.start()
+
+    def record(self, observation: np.ndarray, action: int):
+        """
+        Record a frame.
+        :param observation: the observation
+        :param action: the action
+        :raise IOError: if the writer failed
+        """
+        if self.error is not None:
+            raise IOError('Writing the data set failed: %s' % self.error) from self.error
+        with self.lock:
+            if self.closed:
+                return
+            if self.observation is None:
+                self.observation = np.empty([self.chunk_size] + list(observation.shape), np.uint8)
+            self.observation[len(self.action)] = observation
+            self.action.append(action)
+            if len(self.action) == self.chunk_size:
+                self.flush()
+
+    def flush(self):
+        # Waits while max_chunks chunks are queued, the writer keeps taking chunks even after a failure
+        if len(self.action) > 0:
+            self.queue.put((self.observation[:len(self.action)], self.action))
+        self.observation = None
+        self.action = []
+
+    def close(self):
+        """
+        Flush remaining frames and wait for the writer. Check error afterwards, the
+        remaining frames are lost if the writer failed.
+        """
+        with self.lock:
+            if self.closed:
+                return
+            self.closed = True
+            self.flush()
+            self.queue.put(None)
+        self.thread.join()
+
+    def writer(self):
+        if self.deduplicator is not None:
+            # A session often starts where the previous one stopped, so compare with its last frames
+            try:
+                observation = self.data_file.observation
+                start = max(0, len(observation) - len(self.deduplicator.hashes))
+                self.deduplicator.seed(observation[start:], self.data_file.action[start:])
+            except Exception as e:
+                self.error = e
+        while True:
+            chunk = self.queue.get()
+            if chunk is None:
+                break
+            # Keep taking chunks after a failure, so nobody waits for the queue
+            if self.error is not None:
+                continue
+            observation, action = chunk
+            try:
+                if self.deduplicator is not None:
+                    keep = self.deduplicator.filter(observation, action)
+                    observation, action = observation[keep], np.asarray(action)[keep]
+                self.data_file.append(observation, action, session=self.session)
+            except Exception as e:
+                self.error = e
+
+
+class ChunkedArray:
+
+    def __init__(self, loaders: list, counts: list, shape: list, dtype=np.uint8):
+        """
+        Read-only array over chunk files, which are opened when first accessed.
+        :param loaders: functions opening each chunk as an array-like indexable by index arrays
+        :param counts: the number of items in each chunk
+        :param shape: the shape of an item
+        :param dtype: the type of items
+        """
+        assert len(loaders) == len(counts)
+        self.loaders = loaders
+        self.offsets = np.concatenate([[0], np.cumsum(counts, dtype=np.int64)])
+        self.shape = tuple([int(self.offsets[-1])] + list(shape))
+        self.dtype = np.dtype(dtype)
+        self.chunks = [None] * len(loaders)
+
+    def __len__(self):
+        return self.shape[0]
+
+    def __getitem__(self, key):
+        if isinstance(key, (int, np.integer)):
+            # Count negative keys from the end, like a list
+            if key < 0:
+                key += len(self)
+            if not 0 <= key < len(self):
+                raise IndexError('index %d is out of bounds for size %d' % (key, len(self)))
+            return self.take([key])[0]
+        # Only the sliced range, not the whole data set
+        if isinstance(key, slice):
+            return self.take(np.arange(*key.indices(len(self))))
+        return self.take(np.arange(len(self))[key])
+
+    def chunk(self, position):
+        if self.chunks[position] is None:
+            self.chunks[position] = self.loaders[position]()
+        return self.chunks[position]
+
+    def take(self, indices) -> np.ndarray:
+        """
+        Gather items into a new array, touching only the chunks they live in.
+        :param indices: indices of items
+        :return: the gathered items
+        """
+        indices = np.asarray(indices, np.int64)
+        output = np.empty((len(indices),) + self.shape[1:], self.dtype)
+        positions = np.searchsorted(self.offsets, indices, 'right') - 1
+        for position in np.unique(positions):
+            mask = positions == position
+            output[mask] = self.chunk(position)[indices[mask] - self.offsets[position]]
+        return output
+
+
+class EncodedChunk:
+
+    def __init__(self, data: np.ndarray, offsets: np.ndarray, shape: list):
+        """
+        Images compressed one by one, decoded in parallel when indexed.
+        :param data: concatenated compressed images, usually memory-mapped
+        :param offsets: offsets of images in data, with the end of data at last
+        :param shape: the shape of an image
+        """
+        self.data = data
+        self.offsets = offsets
+        self.shape = tuple([len(offsets) - 1] + list(shape))
+
+    def __len__(self):
+        return self.shape[0]
+
+    def __getitem__(self, indices) -> np.ndarray:
+        indices = np.arange(len(self))[indices]
+        output = np.empty((len(indices),) + self.shape[1:], np.uint8)
+
+        def decode(i):
+            output[i] = cv2.imdecode(self.blob(indices[i]), cv2.IMREAD_UNCHANGED).reshape(self.shape[1:])
+
+        list(get_codec_pool().map(decode, range(len(indices))))
+        return output
+
+    def blob(self, index) -> np.ndarray:
+        return np.asarray(self.data[self.offsets[index]:self.offsets[index+1]])
+
+    def subset(self, indices):
+        """
+        Copy selected images without decoding them.
+        :param indices: indices of images
+        :return: the EncodedChunk of selected images
+        """
+        return EncodedChunk.concatenate([self.blob(index) for index in indices], self.shape[1:])
+
+    def save(self, data_path, offset_path):
+        np.save(data_path, self.data)
+        np.save(offset_path, self.offsets)
+
+    @staticmethod
+    def encode(images: np.ndarray, encoding: str, quality=None):
+        """
+        Compress images in parallel.
+        :param images: images to compress
+        :param encoding: 'png' or 'jpeg'
+        :param quality: the JPEG quality (0-100) or PNG compression level (0-9)
+        :return: the EncodedChunk of images
+        """
+        params = []
+        if quality is not None:
+            params = [cv2.IMWRITE_JPEG_QUALITY if encoding == 'jpeg' else cv2.IMWRITE_PNG_COMPRESSION, quality]
+
+        def encode(image):
+            ret, blob = cv2.imencode(ENCODING_EXTENSIONS[encoding], image, params)
+            assert ret
+            return blob.ravel()
+
+        return EncodedChunk.concatenate(list(get_codec_pool().map(encode, images)), images.shape[1:])
+
+    @staticmethod
+    def concatenate(blobs: list, shape: list):
+        offsets = np.concatenate([[0], np.cumsum([len(blob) for blob in blobs], dtype=np.int64)])
+        data = np.concatenate(blobs) if len(blobs) > 0 else np.zeros([0], np.uint8)
+        return EncodedChunk(data, offsets, shape)
+
+
+class IndexedArray:
+
+    def __init__(self, source, index: np.ndarray, flip: np.ndarray=None):
+        """
+        View of selected items of an array, items are gathered only when indexed.
+        :param source: the viewed array
+        :param index: indices of the selected items in source
+        :param flip: whether each selected item is mirrored horizontally
+        """
+        self.source = source
+        self.index = index
+        self.flip = flip
+        self.shape = (len(index),) + tuple(source.shape[1:])
+
+    def __len__(self):
+        return len(self.index)
+
+    def __getitem__(self, key):
+        if isinstance(key, (int, np.integer)):
+            return self[[key]][0]
+        items = self.source.take(self.index[key])
+        if self.flip is not None:
+            mirror_batch(items, None, self.flip[key])
+        return items
+
+    def take(self, indices) -> np.ndarray:
+        return self[np.asarray(indices, np.int64)]
+
+
+class BatchSampler:
+
+    def __init__(self, images, labels: np.ndarray, batch_size: int, mirror=False, random_seed=None):
+        """
+        Sample training batches epoch by epoch, every frame is seen once per epoch in a shuffled order.
+        :param images: images of data set, an array or a lazy view
+        :param labels: labels of data set
+        :param batch_size: the size of batches
+        :param mirror: whether to mirror half of the sampled frames on the fly
+        :param random_seed: the seed of shuffling and mirroring, None for a random seed
+        """
+        assert len(images) == len(labels)
+        self.images = images
+        self.labels = labels
+        self.batch_size = batch_size
+        self.mirror = mirror
+        self.seed = np.random.randint(2 ** 31) if random_seed is None else random_seed
+        self.random = np.random.RandomState(self.seed)
+        self.lock = Lock()
+        self.epoch = 0
+        self.position = 0
+        # Batches drawn so far
+        self.batches = 0
+        self.permutation = self.shuffle(0)
+
+    def shuffle(self, epoch) -> np.ndarray:
+        # Derived from the seed, so it is regenerated rather than saved in the state
+        return np.random.RandomState([self.seed, epoch]).permutation(len(self.labels))
+
+    def sample_index(self) -> np.ndarray:
+        index = self.permutation[self.position:self.position+self.batch_size]
+        self.position += len(index)
+        # Continue with the next epoch
+        while len(index) < self.batch_size:
+            self.epoch += 1
+            self.permutation = self.shuffle(self.epoch)
+            self.position = self.batch_size - len(index)
+            index = np.concatenate([index, self.permutation[:self.position]])
+        return index
+
+    def sample(self) -> tuple:
+        """
+        Sample a batch.
+        :return: batch images, batch labels, the state of the sampler after this batch
+        """
+        # Concurrent workers draw batches one at a time and gather their frames in parallel,
+        # so batches may be returned out of order. The batch number in the state restores it.
+        with self.lock:
+            batch_index = self.sample_index()
+            flip = self.random.rand(len(batch_index)) < 0.5 if self.mirror else None
+            self.batches += 1
+            state = self.state()
+        batch_image = self.images[batch_index]
+        batch_label = self.labels[batch_index]
+        if self.mirror:
+            mirror_batch(batch_image, batch_label, flip)
+        return batch_image, batch_label, state
+
+    def state(self) -> dict:
+        """
+        :return: the state to resume sampling from, see set_state()
+        """
+        return {
+            'seed': self.seed,
+            'epoch': self.epoch,
+            'position': self.position,
+            'batches': self.batches,
+            'random': self.random.get_state()
+        }
+
+    def set_state(self, state: dict):
+        """
+        Resume sampling from a state returned by state().
+        """
+        with self.lock:
+            self.seed = state['seed']
+            self.epoch = state['epoch']
+            self.position = state['position']
+            self.batches = state['batches']
+            self.random.set_state(state['random'])
+            self.permutation = self.shuffle(self.epoch)
+
+
+class BalancedSampler(BatchSampler):
+
+    def __init__(self, images, labels: np.ndarray, batch_size: int, mirror=False, random_seed=None):
+        """
+        Sample training batches in which every action is equally likely. Frames are drawn with
+        replacement, an epoch is counted every len(labels) frames.
+        """
+        super().__init__(images, labels, batch_size, mirror, random_seed)
+        # Weight every frame by the inverse frequency of its action
+        counts = np.bincount(labels, minlength=NUM_ACTIONS)
+        self.cdf = np.cumsum(1.0 / counts[labels])
+        self.cdf /= self.cdf[-1]
+
+    def sample_index(self) -> np.ndarray:
+        self.position += self.batch_size
+        while self.position >= len(self.labels):
+            self.epoch += 1
+            self.position -= len(self.labels)
+        return np.searchsorted(self.cdf, self.random.rand(self.batch_size), 'right')
+
+
+def dump_json(obj, path):
+    """
+    Replace a JSON file atomically, so a crash never leaves a partial file.
+    """
+    temp_file = path + '.tmp'
+    with open(temp_file, 'w') as file:
+        json.dump(obj, file)
+    os.replace(temp_file, path)
+
+
+def split_index(labels: np.ndarray, test_size=0.3, random_seed=0, groups: np.ndarray=None) -> tuple:
+    """
+    Split indices into training and test set, every label keeps its ratio in both sets.
+    :param labels: labels of data set
+    :param test_size: the fraction of test samples
+    :param random_seed: the seed of the split
+    :param groups: group of each sample, e.g. recording session, to stratify by as well
+    :return: train indices, test indices
+    """
+    strata = labels if groups is None else groups * NUM_ACTIONS + labels
+    random = np.random.RandomState(random_seed)
+    train_index, test_index = [], []
+    for stratum in np.unique(strata):
+        index = random.permutation(np.flatnonzero(strata == stratum))
+        num_test = int(round(len(index) * test_size))
+        test_index.append(index[:num_test])
+        train_index.append(index[num_test:])
+    if len(train_index) == 0:
+        return np.zeros([0], np.int64), np.zeros([0], np.int64)
+    return random.permutation(np.concatenate(train_index)), random.permutation(np.concatenate(test_index))
+
+
+def mirror_batch(images: np.ndarray, labels, flip: np.ndarray):
+    """
+    Mirror selected frames of a batch in place.
+    :param images: batch images
+    :param labels: batch labels, or None
+    :param flip: whether each frame is mirrored
+    """
+    images[flip] = images[flip, :, ::-1]
+    if labels is not None:
+        labels[flip] = MIRROR_ACTION[labels[flip]]
@@ -0,0 +1,117 @@
+import cv2
+import numpy as np
+
+# Number of set bits of every byte
+POPCOUNT = np.array([bin(i).count('1') for i in range(256)], np.uint8)
+
+
+def dhash(images) -> np.ndarray:
+    """
+    Compute 64-bit difference hashes of images, similar images have hashes with a
+    small Hamming distance.
+    :param images: BGR images
+    :return: hashes of images
+    """
+    hashes = np.zeros(len(images), np.uint64)
+    weights = np.left_shift(np.uint64(1), np.arange(64, dtype=np.uint64)).reshape(8, 8)
+    for i, image in enumerate(images):
+        gray = cv2.cvtColor(np.ascontiguousarray(image), cv2.COLOR_BGR2GRAY)
+        small = cv2.resize(gray, (9, 8), interpolation=cv2.INTER_AREA)
+        hashes[i] = np.sum(weights[small[:, 1:] > small[:, :-1]], dtype=np.uint64)
+    return hashes
+
+
+def hamming(hash_value, hashes: np.ndarray) -> np.ndarray:
+    """
+    Hamming distances between a hash and an array of hashes.
+    :param hash_value: the hash
+    :param hashes: the array of hashes
+    :return: distances
+    """
+    diff = np.bitwise_xor(np.asarray(hashes, np.uint64), np.uint64(hash_value))
+    return POPCOUNT[diff.view(np.uint8)].reshape(-1, 8).sum(1)
+
+
+class Deduplicator:
+
+    def __init__(self, max_distance=4, window=256, keep_every=0, num_actions=3):
+        """
+        Drop near-duplicate frames. A frame is a near-duplicate if one of the last
+        kept frames has the same action and a hash within max_distance.
+        :param max_distance: the largest Hamming distance of near-duplicates
+        :param window: the number of last kept frames compared with
+        :param keep_every: keep one in every keep_every near-duplicates to down-weight
+                           them instead of dropping all, 0 to drop all
+        :param num_actions: the number of actions
+        """
+        self.max_distance = max_distance
+        self.keep_every = keep_every
+        self.hashes = np.zeros(window, np.uint64)
+        self.actions = np.full(window, -1, np.int64)
+        self.position = 0
+        self.duplicates = 0
+        self.histogram_in = np.zeros(num_actions, np.int64)
+        self.histogram_out = np.zeros(num_actions, np.int64)
+
+    def seed(self, observation, action):
+        """
+        Fill the window with frames already in the data set, they are compared with
+        but not counted in the report.
+        :param observation: observations of the last frames
+        :param action: actions of the last frames
+        """
+        observation = observation[-len(self.hashes):]
+        action = np.asarray(action, np.int64)[-len(self.hashes):]
+        for hash_value, action_value in zip(dhash(observation), action):
+            self.push(hash_value, action_value)
+
+    def push(self, hash_value, action):
+        self.hashes[self.position] = hash_value
+        self.actions[self.position] = action
+        self.position = (self.position + 1) % len(self.hashes)
+
+    def filter(self, observation, action) -> np.ndarray:
+        """
+        Find frames to keep.
+        :param observation: observations of frames
+        :param action: actions of frames
+        :return: whether each frame is kept
+        """
+        action = np.asarray(action, np.int64)
+        hashes = dhash(observation)
+        keep = np.ones(len(action), np.bool_)
+        for i in range(len(action)):
+            same_action = self.actions == action[i]
+            if np.any(hamming(hashes[i], self.hashes[same_action]) <= self.max_distance):
+                self.duplicates += 1
+                keep[i] = self.keep_every > 0 and self.duplicates % self.keep_every == 0
+            if keep[i]:
+                self.push(hashes[i], action[i])
+        self.histogram_in += np.bincount(action, minlength=len(self.histogram_in))
+        self.histogram_out += np.bincount(action[keep], minlength=len(self.histogram_out))
+        return keep
+
+    def report(self) -> dict:
+        """
+        Report dropped frames.
+        :return: the number of frames seen and dropped, the action histogram
+                 of frames seen and kept
+        """
+        return {
+            'total': int(self.histogram_in.sum()),
+            'removed': int(self.histogram_in.sum() - self.histogram_out.sum()),
+            'histogram_in': self.histogram_in.tolist(),
+            'histogram_out': self.histogram_out.tolist()
+        }
+
+    def summary(self) -> str:
+        """
+        Summarize the report in a line.
+        """
+        report = self.report()
+        ratio_in = self.histogram_in / max(report['total'], 1)
+        ratio_out = self.histogram_out / max(report['total'] - report['removed'], 1)
+        return 'removed %d/%d frames, action ratio %s -> %s' % (
+            report['removed'], report['total'],
+            '/'.join('%.0f%%' % (ratio * 100) for ratio in ratio_in),
+            '/'.join('%.0f%%' % (ratio * 100) for ratio in ratio_out))
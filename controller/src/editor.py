@@ -23,7 +23,7 @@ class FrameEditor:
     SENSOR_SIZE = 10
 
     def __init__(self, height: int, width: int, channel: int,
-                 ob_height: int, ob_width: int):
+                 ob_height: int, ob_width: int, ob_buffers: int=2):
         """
         Create a display engine.
         :param height: the height of the frame
@@ -31,8 +31,9 @@ class FrameEditor:
         :param channel: the channel of the frame
         :param ob_height: the height of the watch region
         :param ob_width: the width of the watch region
+        :param ob_buffers: the number of observations get_observation() cycles through
         """
-        self.frame = np.zeros([height, width, channel])
+        self.frame = np.zeros([height, width, channel], np.uint8)
         self.direction = [0,0,0]
         self.height = height
         self.width = width
@@ -43,24 +44,52 @@ class FrameEditor:
         # Watch region
         self.watch_height = ob_height
         self.watch_width = ob_width
-        self.watch_left = 0
-        self.watch_right = self.width
-        self.watch_top = self.height - int(self.width / self.watch_width * self.watch_height)
-        self.watch_bottom = self.height
         self.mask = None
+        # Observations are resized into a ring of model inputs, each laid out as a batch of one
+        self.observations = np.zeros([ob_buffers, 1, ob_height, ob_width, channel], np.uint8)
+        self.observation_index = 0
+        self.mask_source = None
+        self.mask_resized = None
+        self.mask_contrast = False
+        # Buffers reused by every render, the frame is only read
+        self.allocate(height, width)
+        self.watch_shape = (height, width)
+        self.watch_clip = (slice(self.watch_top, self.watch_bottom), slice(self.watch_left, self.watch_right))
+        self.bar_white = np.full([self.DIRECTION_HEIGHT + 1, self.DIRECTION_WIDTH + 1, channel], 255, np.uint8)
+        # Icons are resized once, with the mask of their bright pixels
+        self.icons = []
+        for i, icon_file in enumerate(self.DIRECTION_ICONS):
+            left, top, right, bottom = self.icon_rect(i)
+            icon = cv2.resize(cv2.imread(icon_file), (right - left, bottom - top))
+            self.icons.append((icon, cv2.cvtColor(icon, cv2.COLOR_BGR2GRAY) > 10))
 
-        self.mask_color = np.zeros([self.height, self.width, 3])
-        self.mask_color[:, :, 1] = 255
-        self.mask_full = np.zeros([self.height, self.width, 1])
+    def allocate(self, height: int, width: int):
+        """
+        Place the watch region and allocate render buffers for frames of a size.
+        :param height: the height of frames
+        :param width: the width of frames
+        """
+        self.height = height
+        self.width = width
+        self.watch_left = 0
+        self.watch_right = width
+        self.watch_top = height - int(width / self.watch_width * self.watch_height)
+        self.watch_bottom = height
+        self.output = np.zeros([height, width, self.channel], np.uint8)
+        region_shape = [self.watch_bottom - self.watch_top, self.watch_right - self.watch_left]
+        self.blend = np.zeros(region_shape + [self.channel], np.float32)
+        self.mask_weight = np.zeros(region_shape + [1], np.float32)
+        self.mask_inverse = np.zeros(region_shape + [1], np.float32)
+        if self.mask_resized is not None:
+            self.update_mask_weight()
 
     def set_frame(self, frame: np.ndarray):
         """
-        Set current video frame
+        Set current video frame, it is not copied and must not change until the next frame.
         :param image: current video frame
         """
-        # Reset frame
-        self.image = frame.copy()
-        self.frame = frame.copy()
+        self.image = frame
+        self.frame = frame
         # Clear mask
         self.mask = None
 
@@ -69,7 +98,12 @@ class FrameEditor:
         Feed the salient map of current sampled region back
         :param mask: current salient map
         """
-        self.mask = cv2.resize(mask, (self.watch_width, self.watch_height))
+        # The same map is fed for several frames, it is only scaled once
+        if mask is not self.mask_source:
+            self.mask_source = mask
+            self.mask_resized = cv2.resize(mask, (self.watch_width, self.watch_height))
+            self.update_mask_weight()
+        self.mask = self.mask_resized
 
     def set_direction(self, direction: list):
         """
@@ -79,64 +113,79 @@ class FrameEditor:
         # assert len(direction) == 3
         self.direction = np.asarray([direction[0], direction[2], direction[1]])
 
+    def icon_rect(self, i) -> tuple:
+        """
+        :return: left, top, right and bottom of the icon of direction i
+        """
+        left = self.DIRECTION_PADDING + (self.DIRECTION_WIDTH + self.DIRECTION_MARGIN) * i
+        top = self.DIRECTION_PADDING
+        return left, top, left + self.DIRECTION_WIDTH, top + self.DIRECTION_WIDTH
+
     def render(self, draw_salient: bool=True, draw_prob: bool=True, draw_border: bool=True):
         """
         Render a frame for display.
         :param draw_salient: whether draw the salient map
         :param draw_prob: whether draw direction probabilities
         :param draw_border: whether draw the watch region
-        :return: the rendered image
+        :return: the rendered image, it is overwritten by the next render
         """
-        output_img = self.frame.copy()
+        # Frames of another size than configured, e.g. from another camera
+        if self.frame.shape[:2] != self.output.shape[:2]:
+            self.allocate(*self.frame.shape[:2])
+        output_img = self.output
+        np.copyto(output_img, self.frame, casting='unsafe')
         # Draw directions
         if draw_prob:
-            bar_overlay = output_img.copy()
-            icon_top = self.DIRECTION_PADDING
-            icon_bottom = self.DIRECTION_PADDING + self.DIRECTION_WIDTH
-            bar_bottom = icon_bottom+self.DIRECTION_PADDING + self.DIRECTION_HEIGHT
             for i in range(len(self.direction)):
-                # Draw background rectangle
-                bar_left = self.DIRECTION_PADDING + (self.DIRECTION_WIDTH + self.DIRECTION_MARGIN) * i
-                bar_right = bar_left+self.DIRECTION_WIDTH
+                bar_left, icon_top, bar_right, icon_bottom = self.icon_rect(i)
                 bar_top = icon_bottom + self.DIRECTION_PADDING
-                bar_overlay = cv2.rectangle(bar_overlay, (bar_left,bar_top), (bar_right,bar_bottom), (255,255,255), -1)
-            output_img = cv2.addWeighted(output_img, 0.5, bar_overlay, 0.5, 0)
-            for i in range(len(self.direction)):
+                bar_bottom = bar_top + self.DIRECTION_HEIGHT
+                # Lighten the background of the bar
+                bar = output_img[bar_top:bar_bottom+1, bar_left:bar_right+1]
+                cv2.addWeighted(bar, 0.5, self.bar_white, 0.5, 0, bar)
                 # Draw foreground rectangle
-                bar_left = self.DIRECTION_PADDING + (self.DIRECTION_WIDTH + self.DIRECTION_MARGIN) * i
-                bar_right = bar_left+self.DIRECTION_WIDTH
-                bar_top = bar_bottom-int(self.DIRECTION_HEIGHT * self.direction[i])
-                output_img = cv2.rectangle(output_img, (bar_left, bar_top), (bar_right, bar_bottom), (255, 255, 255), -1)
+                bar_top = bar_bottom - int(self.DIRECTION_HEIGHT * self.direction[i])
+                output_img[bar_top:bar_bottom+1, bar_left:bar_right+1] = 255
                 # Draw icon
-                icon = cv2.imread(self.DIRECTION_ICONS[i])
-                output_img = self.draw_image(output_img, icon, bar_left, icon_top, bar_right, icon_bottom)
+                icon, icon_mask = self.icons[i]
+                output_img[icon_top:icon_bottom, bar_left:bar_right][icon_mask] = icon[icon_mask]
         # Draw watch area
         if draw_border:
-            output_img = cv2.rectangle(output_img, (self.watch_left, self.watch_top), (self.watch_right - 1, self.watch_bottom - 1), (255, 255, 255))
-        # Draw salient map
-        if draw_salient and self.mask is not None:
-            min_weight = np.min(self.mask)
-            max_weight = np.max(self.mask)
-            if np.abs(max_weight-min_weight) > 0:
-                mask_normed = (self.mask-min_weight)/(max_weight-min_weight)
-                mask_scaled = cv2.resize(mask_normed, (self.watch_right - self.watch_left, self.watch_bottom - self.watch_top))
-
-                self.mask_full[self.watch_top:self.watch_bottom, self.watch_left:self.watch_right, 0] = mask_scaled
-                output_img = output_img * (1 - self.mask_full) + self.mask_color * self.mask_full
-        return output_img.astype(np.uint8)
+            cv2.rectangle(output_img, (self.watch_left, self.watch_top), (self.watch_right - 1, self.watch_bottom - 1), (255, 255, 255))
+        # Draw salient map, blending only the watch region
+        if draw_salient and self.mask is not None and self.mask_contrast:
+            region = output_img[self.watch_top:self.watch_bottom, self.watch_left:self.watch_right]
+            np.multiply(region, self.mask_inverse, out=self.blend)
+            self.blend[:, :, 1:2] += self.mask_weight * 255
+            np.copyto(region, self.blend, casting='unsafe')
+        return output_img
+
+    def update_mask_weight(self):
+        """
+        Normalize and scale the salient map to the watch region, as blending weights.
+        """
+        min_weight = np.min(self.mask_resized)
+        max_weight = np.max(self.mask_resized)
+        self.mask_contrast = np.abs(max_weight-min_weight) > 0
+        if self.mask_contrast:
+            mask_normed = (self.mask_resized-min_weight)/(max_weight-min_weight)
+            self.mask_weight[:, :, 0] = cv2.resize(mask_normed, (self.watch_right - self.watch_left, self.watch_bottom - self.watch_top))
+            np.subtract(1, self.mask_weight, out=self.mask_inverse)
 
     def get_observation(self) -> np.ndarray:
         """
-        Sample for neural network.
-        :return: the sampled image
+        Sample for neural network, by a single resize of the watch region of the frame.
+        :return: the sampled image as a batch of one, valid until get_observation() is called ob_buffers times
         """
-        height, width, _ = self.image.shape
-        watch_left = 0
-        watch_right = width
-        watch_top = height - int(width / self.watch_width * self.watch_height)
-        watch_bottom = height
-        clip = self.image[watch_top:watch_bottom, watch_left:watch_right, :]
-        return cv2.resize(clip, (self.watch_width, self.watch_height))
+        if self.image.shape[:2] != self.watch_shape:
+            # The watch region of frames of another size
+            height, width = self.watch_shape = self.image.shape[:2]
+            watch_top = height - int(width / self.watch_width * self.watch_height)
+            self.watch_clip = (slice(watch_top, height), slice(0, width))
+        observation = self.observations[self.observation_index]
+        self.observation_index = (self.observation_index + 1) % len(self.observations)
+        cv2.resize(self.image[self.watch_clip], (self.watch_width, self.watch_height), observation[0])
+        return observation
 
     @staticmethod
     def draw_image(src: np.ndarray, img: np.ndarray,
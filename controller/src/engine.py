@@ -0,0 +1,111 @@
+import numpy as np
+from numpy.lib.stride_tricks import as_strided
+
+# Layers of the PilotNet in CNN: (convolution, batch normalization, stride)
+CONV_LAYERS = [('conv2d', 'batch_normalization', 2),
+               ('conv2d_1', 'batch_normalization_1', 2),
+               ('conv2d_2', 'batch_normalization_2', 1)]
+DENSE_LAYERS = ['dense', 'dense_1']
+# Epsilon of tf.layers.batch_normalization
+BATCH_NORM_EPSILON = 1e-3
+
+
+def export_weights(model_file, weights_file):
+    """
+    Export weights of a CNN checkpoint for NumpyPilot. Batch normalization runs with its
+    moving statistics at inference, so it is folded into a per-channel scale and shift.
+    It follows the ReLU of the convolution, so it can not be folded into the kernel.
+    :param model_file: the checkpoint of CNN
+    :param weights_file: the .npz file to write
+    """
+    import tensorflow as tf
+    reader = tf.train.NewCheckpointReader(model_file)
+    weights = {}
+    for i, (conv, norm, stride) in enumerate(CONV_LAYERS):
+        gamma = reader.get_tensor(norm + '/gamma')
+        beta = reader.get_tensor(norm + '/beta')
+        mean = reader.get_tensor(norm + '/moving_mean')
+        variance = reader.get_tensor(norm + '/moving_variance')
+        scale = gamma / np.sqrt(variance + BATCH_NORM_EPSILON)
+        weights['conv%d/kernel' % i] = reader.get_tensor(conv + '/kernel')
+        weights['conv%d/bias' % i] = reader.get_tensor(conv + '/bias')
+        weights['conv%d/scale' % i] = scale
+        weights['conv%d/shift' % i] = beta - mean * scale
+        weights['conv%d/stride' % i] = np.asarray(stride)
+    for i, dense in enumerate(DENSE_LAYERS):
+        weights['dense%d/kernel' % i] = reader.get_tensor(dense + '/kernel')
+        weights['dense%d/bias' % i] = reader.get_tensor(dense + '/bias')
+    np.savez(weights_file, **{name: np.asarray(value, np.float32) if value.dtype.kind == 'f' else value
+                              for name, value in weights.items()})
+
+
+def conv2d(images: np.ndarray, kernel: np.ndarray, bias: np.ndarray, stride: int) -> np.ndarray:
+    """
+    Valid convolution by im2col and a single matrix product.
+    :param images: images in NHWC
+    :param kernel: the kernel in HWIO
+    :param bias: the bias
+    :param stride: the stride
+    :return: feature maps in NHWC
+    """
+    num, height, width, channel = images.shape
+    kernel_height, kernel_width, _, filters = kernel.shape
+    out_height = (height - kernel_height) // stride + 1
+    out_width = (width - kernel_width) // stride + 1
+    stride_n, stride_h, stride_w, stride_c = images.strides
+    columns = as_strided(images, (num, out_height, out_width, kernel_height, kernel_width, channel),
+                         (stride_n, stride_h * stride, stride_w * stride, stride_h, stride_w, stride_c))
+    output = columns.reshape(num * out_height * out_width, -1) @ kernel.reshape(-1, filters)
+    output += bias
+    return output.reshape(num, out_height, out_width, filters)
+
+
+def softmax(logits: np.ndarray) -> np.ndarray:
+    exp = np.exp(logits - np.max(logits, 1, keepdims=True))
+    return exp / np.sum(exp, 1, keepdims=True)
+
+
+class NumpyPilot:
+
+    def __init__(self, weights_file):
+        """
+        Run the PilotNet of CNN with NumPy only, from weights exported by export_weights().
+        :param weights_file: the exported .npz file
+        """
+        with np.load(weights_file) as weights:
+            self.weights = dict(weights)
+
+    def predict_proba(self, image) -> np.ndarray:
+        """
+        Predict direction according road image, as CNN.predict_proba.
+        :param image: road images
+        :return: predicted direction
+        """
+        return softmax(self.forward(image))
+
+    def forward(self, image, observe=None) -> np.ndarray:
+        """
+        Compute logits.
+        :param image: road images
+        :param observe: function called with the index and the input of every
+                        convolution and dense layer
+        :return: logits
+        """
+        out = np.asarray(image, np.float32)
+        for i in range(len(CONV_LAYERS)):
+            if observe:
+                observe(i, out)
+            out = conv2d(out, self.weights['conv%d/kernel' % i], self.weights['conv%d/bias' % i],
+                         int(self.weights['conv%d/stride' % i]))
+            # ReLU, batch normalization, ReLU
+            np.maximum(out, 0, out)
+            out *= self.weights['conv%d/scale' % i]
+            out += self.weights['conv%d/shift' % i]
+            np.maximum(out, 0, out)
+        out = out.reshape(len(out), -1)
+        if observe:
+            observe(len(CONV_LAYERS), out)
+        out = np.maximum(out @ self.weights['dense0/kernel'] + self.weights['dense0/bias'], 0)
+        if observe:
+            observe(len(CONV_LAYERS) + 1, out)
+        return out @ self.weights['dense1/kernel'] + self.weights['dense1/bias']
@@ -54,18 +54,26 @@ class ExplorerForm(ContentForm):
         self.setEvent("查找错误分类图片", self.find_miss)
         self.setEvent("删除", self.delete_image)
         self.setEvent("保存", self.save_image)
+        self.compact_thread = None
 
     def showEvent(self, a0: QShowEvent):
+        # Wait for compaction of removed images
+        if self.compact_thread is not None:
+            self.compact_thread.join()
         # Load data
-        self.data_file = DataFile(config.data_file)
-        self.data_obs = self.data_file.data['observation']
-        self.data_act = self.data_file.data['action']
+        self.data_file = DataFile(config.data_dir, config.data_file).select(**config.data_filter)
+        self.data_obs = self.data_file.observation
+        self.data_act = self.data_file.action
         self.viewer_index = 0
         if len(self.data_obs) > 0:
             self.data_pred = self.predict(self.data_obs)
             self.data_miss = np.where(self.data_act != np.argmax(self.data_pred, 1))[0]
             self.load_image()
 
+    def hideEvent(self, a0: QHideEvent):
+        # Drop removed images from disk in background
+        self.compact_thread = self.data_file.compact_async()
+
     def load_image(self):
         assert len(self.data_obs) == len(self.data_act)
         assert len(self.data_obs) == len(self.data_pred)
@@ -113,7 +121,14 @@ class ExplorerForm(ContentForm):
         response = QMessageBox.question(self, "确认删除", "确认从训练数据中删除当前图片？", QMessageBox.Yes, QMessageBox.No)
         if response == QMessageBox.Yes:
             self.data_file.remove(self.viewer_index)
-            np.delete(self.data_pred, self.viewer_index)
+            self.data_obs = self.data_file.observation
+            self.data_act = self.data_file.action
+            self.data_pred = np.delete(self.data_pred, self.viewer_index, 0)
+            # The index is reloaded by remove(), frames recorded meanwhile are at the end
+            if len(self.data_obs) > len(self.data_pred):
+                self.data_pred = np.concatenate([self.data_pred, self.predict(self.data_obs[len(self.data_pred):])])
+            self.data_miss = np.where(self.data_act != np.argmax(self.data_pred, 1))[0]
+            self.viewer_index -= 1
             self.next_image()
 
     def save_image(self):
@@ -130,6 +145,6 @@ class ExplorerForm(ContentForm):
         preds = np.zeros([0,3])
         for i in range(num_batch):
             batch_images = images[i*batch_size:(i+1)*batch_size]
-            batch_predict = self.model.predict(batch_images)[0]
+            batch_predict = self.model.predict_proba(batch_images)
             preds = np.concatenate([preds, batch_predict])
         return preds
@@ -0,0 +1,82 @@
+import time
+from queue import Empty, Full, Queue
+from threading import Thread
+
+import numpy as np
+
+
+class Prefetcher:
+
+    def __init__(self, sampler, depth=4, workers=2, dtype=None):
+        """
+        Prepare batches of a sampler on background threads while the model trains. Batches
+        are taken in the order the sampler drew them, as numbered by state['batches'], so
+        training and resuming from state are the same as with a single worker.
+        :param sampler: the sampler producing (images, labels, state) batches by sample()
+        :param depth: the number of batches prepared ahead
+        :param workers: the number of threads preparing batches
+        :param dtype: the type images are cast to, None to keep their type
+        """
+        self.sampler = sampler
+        self.dtype = dtype
+        self.queue = Queue(depth)
+        self.running = True
+        self.wait_time = 0.0
+        # The sampler state after the last batch taken, to resume from
+        self.state = sampler.state()
+        # Batches prepared ahead of their turn by number
+        self.pending = {}
+        self.threads = [Thread(target=self.worker, daemon=True) for _ in range(workers)]
+        for thread in self.threads:
+            thread.start()
+
+    def worker(self):
+        while self.running:
+            try:
+                images, labels, state = self.sampler.sample()
+                if self.dtype is not None:
+                    images = np.asarray(images, self.dtype)
+                batch = (images, labels, state)
+            except Exception as e:
+                # Passed to next(), which raises it instead of waiting forever
+                batch = e
+            while self.running:
+                try:
+                    self.queue.put(batch, timeout=0.1)
+                    break
+                except Full:
+                    pass
+            if isinstance(batch, Exception):
+                return
+
+    def next(self) -> tuple:
+        """
+        Take the next prepared batch, waiting if none is ready.
+        :return: batch images, batch labels, seconds spent waiting
+        :raise Exception: the exception a worker failed with
+        """
+        start = time.time()
+        number = self.state['batches'] + 1
+        while number not in self.pending:
+            batch = self.queue.get()
+            if isinstance(batch, Exception):
+                raise batch
+            self.pending[batch[2]['batches']] = batch
+        images, labels, self.state = self.pending.pop(number)
+        wait = time.time() - start
+        self.wait_time += wait
+        return images, labels, wait
+
+    def close(self):
+        """
+        Stop the workers.
+        """
+        self.running = False
+        for thread in self.threads:
+            # Unblock workers waiting for a free slot
+            while thread.is_alive():
+                try:
+                    self.queue.get_nowait()
+                except Empty:
+                    pass
+                thread.join(0.1)
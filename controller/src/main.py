@@ -1,8 +1,10 @@
 import os.path
 import socket
 import sys
+import time
 import webbrowser
 from datetime import datetime
+from queue import Full, Queue
 from threading import Thread
 import numpy as np
 import config
@@ -13,12 +15,12 @@ from PyQt5.QtCore import *
 from PyQt5.QtGui import *
 from PyQt5.QtWidgets import *
 from car import Car
-from dataset import DataFile
+from dataset import DataFile, Recorder
+from dedup import Deduplicator
 from editor import FrameEditor
-from explorer import ExplorerForm
 from form import ContentForm
-from cnn import CNN
-from train import TrainForm
+from mjpeg import decode, decode_observation, observation_scale
+from pipeline import LatestSlot
 
 
 class MainForm(ContentForm):
@@ -37,6 +39,7 @@ class MainForm(ContentForm):
         self.key_status = {}
         self.total_frame = 0
         self.auto_frame = 0
+        self.frame_ages = []
         # Setup folder
         for dir in [config.video_dir, config.image_dir]:
             if not os.path.exists(dir):
@@ -52,15 +55,20 @@ class MainForm(ContentForm):
         self.setEvent("开始训练模型", self.open_train)
         self.setEvent("项目主页", self.action_browse_home_page)
         self.setEvent("帮助", self.action_usage)
-        # Create sub forms
-        self.cnn = CNN([config.observation_height, config.observation_width, config.observation_channel], model_file=config.model_file)
-        self.explorer = ExplorerForm(self.cnn)
-        self.train = TrainForm(self.cnn)
+        # Load models in the background, the live view and manual driving do not wait for TensorFlow.
+        # Sub forms are created when they are first opened.
+        self.cnn = None
+        self.pilot = None
+        self.explorer = None
+        self.train = None
+        self.thread_model = Thread(target=self.load_model, daemon=True)
+        self.thread_model.start()
         # Connect
         try:
             self.car = Car(config.host,
                            move_speed=config.move_speed,
-                           turn_speed=config.turn_speed)
+                           turn_speed=config.turn_speed,
+                           native_stream=config.stream_native)
             self.setText("状态栏", "连接成功")
             self.key_map = {
                 Qt.Key_Space: self.car.stop,
@@ -73,14 +81,32 @@ class MainForm(ContentForm):
             self.setText("状态栏", "连接超时")
         except socket.error as e:
             self.setText("状态栏", e.strerror)
-        # Start streamer
+        # Start the pipeline: the streamer steers at inference speed, the renderer shows the newest
+        # steered frame and the video recorder writes frames the renderer queues
         self.keep_streamer = True
+        self.render_slot = LatestSlot()
+        self.video_queue = Queue(config.video_queue_size)
+        self.video_dropped = 0
         self.thread_streamer = Thread(target=self.streamer)
+        self.thread_renderer = Thread(target=self.renderer)
+        self.thread_video = Thread(target=self.video_recorder)
         self.thread_streamer.start()
+        self.thread_renderer.start()
+        self.thread_video.start()
 
     def closeEvent(self, event: QCloseEvent):
         self.keep_streamer = False
         self.thread_streamer.join()
+        self.render_slot.close()
+        self.thread_renderer.join()
+        if self.video_mode:
+            self.video_queue.put((self.video_writer, None))
+        self.video_queue.put(None)
+        self.thread_video.join()
+        if hasattr(self, 'car'):
+            self.car.close()
+        if self.data_mode:
+            self.recorder.close()
 
     def keyPressEvent(self, event: QKeyEvent):
         # Ignore auto repeat
@@ -121,8 +147,8 @@ class MainForm(ContentForm):
     def action_video(self):
         if self.video_mode:
             self.video_mode = False
-            # Save video
-            self.video_writer.release()
+            # Save video after the queued frames
+            self.video_queue.put((self.video_writer, None))
             self.setText("状态栏", "视频录制完成")
             # Reset action to [start]
             self.action_set["录制视频"].setText("录制视频")
@@ -140,17 +166,27 @@ class MainForm(ContentForm):
     def action_data(self):
         if self.data_mode:
             self.data_mode = False
-            # Save video
-            self.data_file = DataFile(config.data_file)
-            self.data_file.append(self.data_observations, self.data_actions)
-            self.setText("状态栏", "视频录制完成：")
+            # Flush remaining data
+            self.recorder.close()
+            if self.recorder.error is not None:
+                message = "数据录制失败：%s" % self.recorder.error
+            elif self.recorder.deduplicator is not None:
+                message = "数据录制完成：" + self.recorder.deduplicator.summary()
+            else:
+                message = "数据录制完成"
+            self.setText("状态栏", message)
             # Reset action to [start]
             self.action_set["录制数据"].setText("录制数据")
             self.action_set["录制数据"].setIcon(QIcon("../res/data.png"))
         else:
             self.setText("状态栏", "开始录制数据")
-            self.data_observations = []
-            self.data_actions = []
+            deduplicator = None
+            if config.dedup_distance is not None:
+                deduplicator = Deduplicator(config.dedup_distance, config.dedup_window, config.dedup_keep_every)
+            self.recorder = Recorder(DataFile(config.data_dir, config.data_file,
+                                              config.data_encoding, config.data_quality),
+                                     config.record_chunk_size, tags=config.data_tags,
+                                     deduplicator=deduplicator)
             self.data_mode = True
             # Reset action to [stop]
             self.action_set["录制数据"].setText("停止录制数据")
@@ -160,12 +196,22 @@ class MainForm(ContentForm):
         if self.test_mode:
             self.test_mode = False
             if self.total_frame > 0:
-                self.setText("状态栏", "性能指标：%f（%d帧）" % (self.auto_frame/self.total_frame, self.total_frame))
+                # Frame age is measured from decoding to actuation, over automatically steered frames
+                frame_age = "，帧龄中位数%.0fms，P95 %.0fms" % (np.median(self.frame_ages) * 1000,
+                                                         np.percentile(self.frame_ages, 95) * 1000) \
+                    if self.frame_ages else ""
+                # Camera frames the streamer was too slow for during the test
+                skipped = self.car.skipped_frames - self.skipped_start if hasattr(self, 'car') else 0
+                self.setText("状态栏", "性能指标：%f（%d帧，相机跳帧%d，显示丢帧%d，视频丢帧%d%s）" % (
+                    self.auto_frame/self.total_frame, self.total_frame, skipped, self.render_slot.dropped,
+                    self.video_dropped, frame_age))
             self.auto_frame = 0
             self.total_frame = 0
+            self.frame_ages = []
             self.action_set["性能测试"].setText("性能测试")
             self.action_set["性能测试"].setIcon(QIcon("../res/test.png"))
         else:
+            self.skipped_start = self.car.skipped_frames if hasattr(self, 'car') else 0
             self.test_mode = True
             self.action_set["性能测试"].setText("停止性能测试")
             self.action_set["性能测试"].setIcon(QIcon("../res/test_stop.png"))
@@ -178,10 +224,41 @@ class MainForm(ContentForm):
     def action_open_video_folder():
         util.open_file_xdg(config.video_dir)
 
+    def load_model(self):
+        # Steer with the exported weights until TensorFlow is ready
+        if os.path.isfile(config.engine_file):
+            from engine import NumpyPilot
+            self.pilot = NumpyPilot(config.engine_file)
+        try:
+            from cnn import CNN, session_config
+            self.cnn = CNN([config.observation_height, config.observation_width, config.observation_channel],
+                           model_file=config.model_file,
+                           session_config=session_config(*config.train_threads),
+                           inference_config=session_config(*config.inference_threads))
+            self.pilot = self.cnn
+        except Exception as e:
+            self.setText("状态栏", "模型加载失败：%s" % e)
+
+    def wait_model(self):
+        if self.cnn is None:
+            self.setText("状态栏", "正在加载模型...")
+            self.thread_model.join()
+        return self.cnn
+
     def open_data_explorer(self):
+        if self.explorer is None:
+            if self.wait_model() is None:
+                return
+            from explorer import ExplorerForm
+            self.explorer = ExplorerForm(self.cnn)
         self.explorer.show()
 
     def open_train(self):
+        if self.train is None:
+            if self.wait_model() is None:
+                return
+            from train import TrainForm
+            self.train = TrainForm(self.cnn)
         self.train.show()
         self.cnn.load(config.model_file)
 
@@ -196,29 +273,87 @@ class MainForm(ContentForm):
         qbox.show()
 
     def streamer(self):
+        # Only crops observations, frames are drawn by the renderer
         frame_editor = FrameEditor(config.stream_height,
                                    config.stream_width,
                                    config.stream_channel,
                                    config.observation_height,
                                    config.observation_width)
-
+        # Decode observations at reduced scale from the native stream, full frames are decoded by the renderer
+        scale = observation_scale(config.stream_height, config.stream_width,
+                                  config.observation_height, config.observation_width)
+        salient = None
+        frame_index = 0
         while self.keep_streamer:
-            ret, frame = self.car.read_camera()
+            ret, frame, frame_time = self.car.read_frame_timed()
             if not ret:
                 self.setText("状态栏", "视频信号中断")
                 break
+            # Observations are batches of one, fed to the model as they are
+            if isinstance(frame, bytes) and scale is not None:
+                observation = decode_observation(frame, scale, config.observation_height)[None]
+            else:
+                if isinstance(frame, bytes):
+                    frame = decode(frame)
+                frame_editor.set_frame(frame)
+                observation = frame_editor.get_observation()
+            # Predict actions, the salient map is only computed every n frames when displayed
+            # and needs TensorFlow. There is no prediction until a model is loaded.
+            draw_salient = self.isChecked("显示观测区域活跃度") and self.cnn is not None
+            pilot = self.pilot
+            probs, action = None, None
+            if draw_salient and frame_index % config.salient_interval == 0:
+                probs, salients = self.cnn.predict(observation)
+                salient = salients[0]
+            elif pilot is not None:
+                probs = pilot.predict_proba(observation)
+            if probs is not None:
+                action = np.argmax(probs[0])
+            frame_index += 1
+            # Self driving
+            if self.auto_mode and action is not None:
+                self.car.step(action)
+                # Age of the frame when the car acts on it
+                if self.test_mode:
+                    self.frame_ages.append(time.time() - frame_time)
+            # Data Record
+            if self.data_mode and self.key_stack[-1] in [Qt.Key_A, Qt.Key_D, Qt.Key_W]:
+                action_map = {Qt.Key_A:0, Qt.Key_D:1, Qt.Key_W:2}
+                # Steering goes on if the data set cannot be written
+                try:
+                    self.recorder.record(observation[0], action_map[self.key_stack[-1]])
+                except IOError:
+                    self.setText("状态栏", "数据录制失败：%s" % self.recorder.error)
+            if self.test_mode:
+                if self.auto_mode:
+                    self.auto_frame += 1
+                    self.total_frame += 1
+                elif self.key_stack[-1] != Qt.Key_Space:
+                    self.total_frame += 1
+            # Hand the frame to the renderer, which skips frames it is too slow for
+            self.render_slot.put((frame, probs, salient if draw_salient else None))
+
+    def renderer(self):
+        frame_editor = FrameEditor(config.stream_height,
+                                   config.stream_width,
+                                   config.stream_channel,
+                                   config.observation_height,
+                                   config.observation_width)
+        while True:
+            item = self.render_slot.get()
+            if item is None:
+                break
+            frame, probs, salient = item
+            if isinstance(frame, bytes):
+                frame = decode(frame)
             frame_editor.set_frame(frame)
-            observation = frame_editor.get_observation()
-            # # Predict actions
-            probs, salients = self.cnn.predict([observation])
-            prob = probs[0]
-            salient = salients[0]
-            action = np.argmax(prob)
-            frame_editor.set_direction(prob)
-            frame_editor.set_salient(salient)
-            frame = frame_editor.render(draw_salient=self.isChecked("显示观测区域活跃度"),
-                                  draw_prob=self.isChecked("显示预测置信度"),
-                                  draw_border=self.isChecked("显示观测区域边框"))
+            if probs is not None:
+                frame_editor.set_direction(probs[0])
+            if salient is not None:
+                frame_editor.set_salient(salient)
+            frame = frame_editor.render(draw_salient=salient is not None,
+                                        draw_prob=self.isChecked("显示预测置信度"),
+                                        draw_border=self.isChecked("显示观测区域边框"))
             # Convert image
             frame = cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)
             image = QImage(frame.data, frame.shape[1], frame.shape[0], QImage.Format_RGB888)
@@ -229,24 +364,24 @@ class MainForm(ContentForm):
                 cv2.imwrite(file_name, frame)
                 self.setText("状态栏", "截图保存至：%s" % file_name)
                 self.camera_mode = False
-            # Video Record
+            # Video Record, frames are dropped rather than delaying the view when the disk is slow
             if self.video_mode:
-                self.video_writer.write(frame)
-            # Data Record
-            if self.data_mode and self.key_stack[-1] in [Qt.Key_A, Qt.Key_D, Qt.Key_W]:
-                self.data_observations.append(observation)
-                action_map = {Qt.Key_A:0, Qt.Key_D:1, Qt.Key_W:2}
-                self.data_actions.append(action_map[self.key_stack[-1]])
-            # Self driving
-            if self.auto_mode:
-                self.car.step(action)
-            if self.test_mode:
-                if self.auto_mode:
-                    self.auto_frame += 1
-                    self.total_frame += 1
-                elif self.key_stack[-1] != Qt.Key_Space:
-                    self.total_frame += 1
+                try:
+                    self.video_queue.put_nowait((self.video_writer, frame))
+                except Full:
+                    self.video_dropped += 1
 
+    def video_recorder(self):
+        while True:
+            item = self.video_queue.get()
+            if item is None:
+                break
+            video_writer, frame = item
+            # A frame of None ends the video
+            if frame is None:
+                video_writer.release()
+            else:
+                video_writer.write(frame)
 
 if __name__ == '__main__':
     app = QApplication(sys.argv)
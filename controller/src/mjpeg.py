@@ -0,0 +1,152 @@
+import re
+import socket
+from urllib.parse import urlsplit
+
+import cv2
+import numpy as np
+
+# Flags decoding JPEG at a fraction of its size, by the scale
+REDUCED_FLAGS = {1: cv2.IMREAD_COLOR, 2: cv2.IMREAD_REDUCED_COLOR_2,
+                 4: cv2.IMREAD_REDUCED_COLOR_4, 8: cv2.IMREAD_REDUCED_COLOR_8}
+
+
+class MjpegStream:
+
+    def __init__(self, url, time_out=5, buffer_size=1 << 18):
+        """
+        Read a multipart JPEG stream over HTTP, as sent by mjpg-streamer and the simulator.
+        The stream is received into a preallocated buffer and JPEG frames are not decoded,
+        so frames nobody looks at cost nothing.
+        :param url: the URL of the stream
+        :param time_out: seconds to wait for data
+        :param buffer_size: the initial size of the receive buffer, it grows to hold a frame
+        """
+        parts = urlsplit(url)
+        self.socket = socket.create_connection((parts.hostname, parts.port or 80), time_out)
+        path = parts.path or '/'
+        if parts.query:
+            path += '?' + parts.query
+        self.socket.sendall(('GET %s HTTP/1.0\r\nHost: %s\r\n\r\n' % (path, parts.hostname)).encode())
+        self.buffer = bytearray(buffer_size)
+        self.view = memoryview(self.buffer)
+        self.start = 0
+        self.end = 0
+        # Response header
+        header_end = self.find(b'\r\n\r\n')
+        header = bytes(self.view[self.start:header_end]).decode('latin-1')
+        self.start = header_end + 4
+        status = header.split('\r\n', 1)[0].split()
+        if len(status) < 2 or status[1] != '200':
+            raise IOError('Unexpected response of stream: %s' % header.split('\r\n', 1)[0])
+        match = re.search(r'boundary="?([^";\r\n]+)"?', header, re.IGNORECASE)
+        if match is None:
+            raise IOError('Stream is not multipart')
+        boundary = match.group(1).encode()
+        self.boundary = boundary if boundary.startswith(b'--') else b'--' + boundary
+
+    def fill(self):
+        """
+        Receive more data after the unread data.
+        """
+        if self.end == len(self.buffer):
+            if self.start > 0:
+                # Move unread data to the front
+                size = self.end - self.start
+                self.buffer[:size] = self.buffer[self.start:self.end]
+                self.start, self.end = 0, size
+            else:
+                # A frame is larger than the buffer
+                buffer = bytearray(len(self.buffer) * 2)
+                buffer[:self.end] = self.buffer[:self.end]
+                self.buffer, self.view = buffer, memoryview(buffer)
+        size = self.socket.recv_into(self.view[self.end:])
+        if size == 0:
+            raise EOFError('Stream closed')
+        self.end += size
+
+    def find(self, delimiter: bytes) -> int:
+        """
+        Receive until the delimiter is in the unread data.
+        :return: the position of the delimiter in the buffer
+        """
+        offset = 0
+        while True:
+            index = self.buffer.find(delimiter, self.start + offset, self.end)
+            if index >= 0:
+                return index
+            # Positions move when the buffer is compacted, so search from the same offset to start
+            offset = max(0, self.end - self.start - len(delimiter) + 1)
+            self.fill()
+
+    def read_jpeg(self) -> memoryview:
+        """
+        Read the next frame.
+        :return: the JPEG data, only valid until the next read
+        """
+        self.start = self.find(self.boundary) + len(self.boundary)
+        header_end = self.find(b'\r\n\r\n')
+        header = bytes(self.view[self.start:header_end]).decode('latin-1')
+        self.start = header_end + 4
+        match = re.search(r'content-length:\s*(\d+)', header, re.IGNORECASE)
+        if match:
+            length = int(match.group(1))
+            while self.end - self.start < length:
+                self.fill()
+            end = self.start + length
+        else:
+            # Without a length the frame ends at the next boundary
+            end = self.find(self.boundary)
+            while end > self.start and self.buffer[end - 1] in b'\r\n':
+                end -= 1
+        data = self.view[self.start:end]
+        self.start = end
+        return data
+
+    def read(self) -> tuple:
+        """
+        Read and decode the next frame, as cv2.VideoCapture.read().
+        :return: whether a frame is read, the frame
+        """
+        try:
+            return True, decode(self.read_jpeg())
+        except (OSError, EOFError):
+            return False, None
+
+    def release(self):
+        self.socket.close()
+
+
+def decode(data, scale=1) -> np.ndarray:
+    """
+    Decode JPEG data.
+    :param data: JPEG data
+    :param scale: the factor the image is shrunk by while decoding, 1, 2, 4 or 8
+    :return: the image
+    """
+    return cv2.imdecode(np.frombuffer(data, np.uint8), REDUCED_FLAGS[scale])
+
+
+def observation_scale(frame_height, frame_width, ob_height, ob_width):
+    """
+    Check whether the observation is exactly the bottom rows of the frame decoded at a reduced scale.
+    The watch region of FrameEditor spans the frame width, so the scale is the ratio of the widths.
+    :return: the scale, None if the observation needs a full decode and a resize
+    """
+    if frame_width % ob_width != 0:
+        return None
+    scale = frame_width // ob_width
+    if scale not in REDUCED_FLAGS or frame_height % scale != 0 or frame_height // scale < ob_height:
+        return None
+    return scale
+
+
+def decode_observation(data, scale, ob_height) -> np.ndarray:
+    """
+    Decode the observation of a frame at reduced scale, without decoding the full frame.
+    :param data: JPEG data
+    :param scale: the scale returned by observation_scale()
+    :param ob_height: the height of the observation
+    :return: the observation, a view of the bottom rows of the reduced frame
+    """
+    image = decode(data, scale)
+    return image[image.shape[0] - ob_height:]
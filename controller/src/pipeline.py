@@ -0,0 +1,44 @@
+from threading import Condition
+
+
+class LatestSlot:
+
+    def __init__(self):
+        """
+        Hand items from a producer thread to a consumer thread, keeping only the newest.
+        The producer never waits, items the consumer is too slow for are dropped.
+        """
+        self.condition = Condition()
+        self.item = None
+        self.closed = False
+        self.dropped = 0
+
+    def put(self, item):
+        """
+        Replace the waiting item, if any, by a newer one.
+        """
+        with self.condition:
+            if self.item is not None:
+                self.dropped += 1
+            self.item = item
+            self.condition.notify()
+
+    def get(self, timeout=None):
+        """
+        Take the newest item, waiting for one.
+        :param timeout: seconds to wait, None to wait until an item is put or the slot is closed
+        :return: the item, None if the slot is closed or the wait timed out
+        """
+        with self.condition:
+            self.condition.wait_for(lambda: self.item is not None or self.closed, timeout)
+            item, self.item = self.item, None
+            return item
+
+    def close(self):
+        """
+        Wake the consumer, get() returns None from now on.
+        """
+        with self.condition:
+            self.closed = True
+            self.item = None
+            self.condition.notify_all()
@@ -0,0 +1,180 @@
+#!/usr/bin/env python
+
+import json
+import resource
+import subprocess
+import sys
+
+import numpy as np
+
+from engine import CONV_LAYERS, NumpyPilot, conv2d, softmax
+
+# Rows of the dense kernel widened to float32 at a time
+DENSE_BLOCK = 2048
+
+
+def quantize(weights_file, images, output_file, percentile=99.99, batch_size=100):
+    """
+    Quantize weights exported by export_weights() to int8. Kernels are quantized
+    symmetrically per output channel. Inputs of every layer are non-negative (pixels
+    or ReLU outputs), so they are quantized to uint8 with a scale calibrated on images.
+    :param weights_file: the exported float weights
+    :param images: calibration images
+    :param output_file: the .npz file of the int8 model
+    :param percentile: the percentile of layer inputs mapped to 255, which clips outliers
+    :param batch_size: the calibration batch size
+    """
+    pilot = NumpyPilot(weights_file)
+    num_layers = len(CONV_LAYERS) + 2
+    input_max = np.zeros(num_layers)
+
+    def observe(layer, inputs):
+        input_max[layer] = max(input_max[layer], np.percentile(inputs, percentile))
+
+    for i in range(0, len(images), batch_size):
+        pilot.forward(images[i:i+batch_size], observe)
+    # Pixels are already uint8
+    input_max[0] = 255.0
+    model = {}
+    for name, value in pilot.weights.items():
+        if not name.endswith('/kernel'):
+            model[name] = value
+    layers = ['conv%d' % i for i in range(len(CONV_LAYERS))] + ['dense0', 'dense1']
+    for layer, maximum in zip(layers, input_max):
+        kernel = pilot.weights[layer + '/kernel']
+        kernel_max = np.max(np.abs(kernel.reshape(-1, kernel.shape[-1])), 0)
+        kernel_scale = np.where(kernel_max > 0, kernel_max / 127.0, 1.0).astype(np.float32)
+        model[layer + '/kernel_q'] = np.clip(np.rint(kernel / kernel_scale), -127, 127).astype(np.int8)
+        model[layer + '/kernel_scale'] = kernel_scale
+        model[layer + '/input_scale'] = np.float32(max(maximum, 1e-6) / 255.0)
+    np.savez(output_file, **model)
+
+
+def quantize_input(inputs: np.ndarray, scale) -> np.ndarray:
+    """
+    Quantize non-negative inputs to uint8 levels, kept in float32 for the matrix product.
+    """
+    if scale == 1.0 and inputs.dtype == np.uint8:
+        return inputs.astype(np.float32)
+    levels = inputs / scale
+    np.rint(levels, levels)
+    return np.clip(levels, 0, 255, levels)
+
+
+class Int8Pilot:
+
+    def __init__(self, model_file):
+        """
+        Simulate an int8 model written by quantize(), to measure the accuracy and size of
+        quantization. NumPy has no int8 matrix product, so uint8 inputs and int8 kernels are
+        multiplied as integer-valued float32, which is exact per product but not faster than
+        the float model. Conv kernels are widened once, the large dense kernel stays int8 in
+        memory and is widened block by block.
+        :param model_file: the int8 model
+        """
+        with np.load(model_file) as model:
+            self.model = dict(model)
+        self.conv_kernels = [self.model['conv%d/kernel_q' % i].astype(np.float32) for i in range(len(CONV_LAYERS))]
+
+    def predict_proba(self, image) -> np.ndarray:
+        """
+        Predict direction according road image, as CNN.predict_proba.
+        :param image: road images
+        :return: predicted direction
+        """
+        out = np.asarray(image)
+        for i in range(len(CONV_LAYERS)):
+            layer = 'conv%d' % i
+            input_scale = self.model[layer + '/input_scale']
+            out = conv2d(quantize_input(out, input_scale), self.conv_kernels[i], 0.0,
+                         int(self.model[layer + '/stride']))
+            out *= input_scale * self.model[layer + '/kernel_scale']
+            out += self.model[layer + '/bias']
+            # ReLU, batch normalization, ReLU
+            np.maximum(out, 0, out)
+            out *= self.model[layer + '/scale']
+            out += self.model[layer + '/shift']
+            np.maximum(out, 0, out)
+        out = np.maximum(self.dense('dense0', out.reshape(len(out), -1)), 0)
+        return softmax(self.dense('dense1', out))
+
+    def dense(self, layer, inputs: np.ndarray) -> np.ndarray:
+        input_scale = self.model[layer + '/input_scale']
+        inputs = quantize_input(inputs, input_scale)
+        kernel = self.model[layer + '/kernel_q']
+        out = np.zeros([len(inputs), kernel.shape[1]], np.float32)
+        for i in range(0, kernel.shape[0], DENSE_BLOCK):
+            out += inputs[:, i:i+DENSE_BLOCK] @ kernel[i:i+DENSE_BLOCK].astype(np.float32)
+        out *= input_scale * self.model[layer + '/kernel_scale']
+        out += self.model[layer + '/bias']
+        return out
+
+
+def evaluate(predict_proba, images, labels, batch_size=100) -> tuple:
+    """
+    :return: predicted labels, accuracy
+    """
+    predictions = np.concatenate([np.argmax(predict_proba(images[i:i+batch_size]), 1)
+                                  for i in range(0, len(labels), batch_size)])
+    return predictions, np.mean(predictions == labels)
+
+
+def measure_memory(model, model_file, shape):
+    """
+    Load a model, predict a frame and print the peak resident memory in MB, as bench_engine.py.
+    """
+    pilot = NumpyPilot(model_file) if model == 'float' else Int8Pilot(model_file)
+    pilot.predict_proba(np.zeros([1] + list(shape), np.uint8))
+    print(json.dumps({'rss': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024}))
+
+
+def resident_memory(model, model_file, shape) -> float:
+    """
+    Measure a model in a fresh process, so memory is not shared with the other model.
+    :return: the peak resident memory in MB
+    """
+    output = subprocess.check_output([sys.executable, __file__, '--measure', model, '--weights_file', model_file,
+                                      '--shape'] + [str(size) for size in shape])
+    return json.loads(output.decode().strip().splitlines()[-1])['rss']
+
+
+def main():
+    # Parse arguments
+    import argparse
+    import config
+    parser = argparse.ArgumentParser(description='Quantize the driving model to int8 and report the accuracy '
+                                                 'delta and memory. This is an accuracy and size study only: '
+                                                 'int8 arithmetic is simulated in float32, it is not faster.')
+    parser.add_argument('--weights_file', type=str, default=config.engine_file)
+    parser.add_argument('--output_file', type=str, default=config.int8_file)
+    parser.add_argument('--calibration', type=int, default=1000, help='Training frames used for calibration')
+    parser.add_argument('--percentile', type=float, default=99.99)
+    parser.add_argument('--measure', choices=['float', 'int8'], help=argparse.SUPPRESS)
+    parser.add_argument('--shape', type=int, nargs=3, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    # Worker process
+    if args.measure:
+        measure_memory(args.measure, args.weights_file, args.shape)
+        return
+
+    from dataset import DataFile
+    data_file = DataFile(config.data_dir, config.data_file).select(**config.data_filter)
+    train_obs, _, test_obs, test_act = data_file.gen_train_set()
+    calibration = train_obs[np.random.choice(len(train_obs), min(args.calibration, len(train_obs)), False)]
+    quantize(args.weights_file, calibration, args.output_file, args.percentile)
+
+    float_pilot = NumpyPilot(args.weights_file)
+    int8_pilot = Int8Pilot(args.output_file)
+    float_pred, float_acc = evaluate(float_pilot.predict_proba, test_obs, test_act)
+    int8_pred, int8_acc = evaluate(int8_pilot.predict_proba, test_obs, test_act)
+    print('validation frames: %d' % len(test_act))
+    print('%-8s %10s %10s' % ('model', 'val acc', 'rss MB'))
+    for name, accuracy, model_file in [('float', float_acc, args.weights_file), ('int8', int8_acc, args.output_file)]:
+        print('%-8s %10.4f %10.0f' % (name, accuracy, resident_memory(name, model_file, test_obs.shape[1:])))
+    print('accuracy delta: %+.4f' % (int8_acc - float_acc))
+    print('prediction agreement: %.4f' % np.mean(float_pred == int8_pred))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,148 @@
+#!/usr/bin/env python
+
+import csv
+import itertools
+import json
+import multiprocessing
+import os
+import shutil
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import numpy as np
+
+import config
+from dataset import DataFile
+
+# Hyperparameters a trial may set, and their defaults
+DEFAULT_PARAMS = {
+    'learning_rate': 1e-3,
+    'batch_size': 100,
+    'iters': 1000,
+    'balanced': False,
+    'input_scale': 1.0
+}
+
+
+def expand_spec(spec: dict, random_seed=0) -> list:
+    """
+    Expand a search spec into trials. A grid spec lists the values of every parameter and
+    runs every combination:
+        {"search": "grid", "params": {"learning_rate": [1e-3, 3e-4], "batch_size": [100, 200]}}
+    A random spec runs a number of trials, each parameter is drawn from a list of values or
+    a range, {"uniform": [low, high]} or {"log_uniform": [low, high]}:
+        {"search": "random", "trials": 8, "params": {"learning_rate": {"log_uniform": [1e-4, 1e-2]}}}
+    :param spec: the search spec
+    :param random_seed: the seed of random search
+    :return: parameters of every trial
+    """
+    params = spec['params']
+    unknown = set(params) - set(DEFAULT_PARAMS)
+    if unknown:
+        raise ValueError('Unknown parameters: %s' % ', '.join(sorted(unknown)))
+    if spec.get('search', 'grid') == 'grid':
+        names = sorted(params)
+        return [dict(DEFAULT_PARAMS, **dict(zip(names, values)))
+                for values in itertools.product(*[params[name] for name in names])]
+    random = np.random.RandomState(random_seed)
+    trials = []
+    for _ in range(spec['trials']):
+        trial = dict(DEFAULT_PARAMS)
+        for name, values in sorted(params.items()):
+            if isinstance(values, list):
+                value = values[random.randint(len(values))]
+            elif 'log_uniform' in values:
+                low, high = values['log_uniform']
+                value = float(np.exp(random.uniform(np.log(low), np.log(high))))
+            else:
+                low, high = values['uniform']
+                value = float(random.uniform(low, high))
+            value = value.item() if isinstance(value, np.generic) else value
+            # Ranges of integer parameters are rounded
+            trial[name] = int(round(value)) if type(DEFAULT_PARAMS[name]) is int else value
+        trials.append(trial)
+    return trials
+
+
+def run_trial(trial_id, params, data_dir, threads, print_iters, target_acc) -> dict:
+    """
+    Train a model in a worker process.
+    :return: parameters and results of the trial
+    """
+    from cnn import CNN, session_config
+    # The snapshot is memory-mapped, workers share its pages
+    train_obs, train_act, test_obs, test_act = DataFile(data_dir).gen_train_set()
+    model = CNN(list(train_obs.shape[1:]), learning_rate=params['learning_rate'],
+                input_scale=params['input_scale'], session_config=session_config(threads, threads))
+    # Time of every report, for the time to reach the target accuracy
+    report_times = []
+    start = time.time()
+    history = model.fit(train_obs, train_act, test_obs, test_act,
+                        batch_size=params['batch_size'], iters=params['iters'], print_iters=print_iters,
+                        report_func=lambda i, hist: report_times.append(time.time() - start),
+                        mirror=True, balanced=params['balanced'], random_seed=trial_id)
+    train_time = time.time() - start
+    reached = [i for i, acc in enumerate(history['val_acc']) if acc >= target_acc]
+    return dict(params, **{
+        'trial': trial_id,
+        'final_train_acc': history['final_train_acc'],
+        'final_val_acc': history['final_val_acc'],
+        'best_val_acc': max(history['val_acc']) if history['val_acc'] else float('nan'),
+        'train_time': train_time,
+        'iters_to_acc': history['eval_iters'][reached[0]] if reached else '',
+        'time_to_acc': report_times[reached[0]] if reached else ''
+    })
+
+
+def main():
+    # Parse arguments
+    import argparse
+    parser = argparse.ArgumentParser(description='Search hyperparameters of the CNN without the user interface.')
+    parser.add_argument('spec', type=str, help='JSON file of the search spec, see expand_spec()')
+    parser.add_argument('--output_file', type=str, default='sweep.csv')
+    parser.add_argument('--data_dir', type=str, default=config.data_dir)
+    parser.add_argument('--workers', type=int, default=2, help='Trials run at the same time')
+    parser.add_argument('--threads', type=int, default=0, help='Threads per trial, 0 to divide the cores')
+    parser.add_argument('--print_iters', type=int, default=100, help='Iterations between accuracy estimates')
+    parser.add_argument('--target_acc', type=float, default=0.9, help='Validation accuracy timed to reach')
+    parser.add_argument('--random_seed', type=int, default=0)
+    args = parser.parse_args()
+
+    with open(args.spec) as file:
+        trials = expand_spec(json.load(file), args.random_seed)
+    threads = args.threads or max(1, (os.cpu_count() or 1) // args.workers)
+    print('%d trials, %d workers with %d threads each' % (len(trials), args.workers, threads))
+    # One raw snapshot of the selected frames, read-only for all workers and safe from recording
+    work_dir = tempfile.mkdtemp()
+    try:
+        data_dir = os.path.join(work_dir, 'data')
+        DataFile(args.data_dir, config.data_file).select(**config.data_filter).copy_to(data_dir)
+        results = []
+        # Spawned workers do not inherit the state of this process. They read the environment
+        # when they start, before NumPy and TensorFlow create their thread pools.
+        for name in ['OMP_NUM_THREADS', 'MKL_NUM_THREADS', 'OPENBLAS_NUM_THREADS']:
+            os.environ[name] = str(threads)
+        context = multiprocessing.get_context('spawn')
+        with ProcessPoolExecutor(args.workers, mp_context=context) as executor:
+            futures = [executor.submit(run_trial, i, trial, data_dir, threads, args.print_iters, args.target_acc)
+                       for i, trial in enumerate(trials)]
+            for future in as_completed(futures):
+                result = future.result()
+                results.append(result)
+                print('trial %d: val acc = %.4f, time = %.1fs' %
+                      (result['trial'], result['final_val_acc'], result['train_time']))
+    finally:
+        shutil.rmtree(work_dir)
+    results.sort(key=lambda result: result['trial'])
+    fields = ['trial'] + sorted(DEFAULT_PARAMS) + ['final_train_acc', 'final_val_acc', 'best_val_acc',
+                                                   'train_time', 'iters_to_acc', 'time_to_acc']
+    with open(args.output_file, 'w', newline='') as file:
+        writer = csv.DictWriter(file, fields)
+        writer.writeheader()
+        writer.writerows(results)
+    print('results written to %s' % args.output_file)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,38 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+from checkpoint import Checkpointer
+
+
+class CheckpointerTest(unittest.TestCase):
+
+    def setUp(self):
+        self.work_dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.work_dir)
+
+    def test_save(self):
+        filename = os.path.join(self.work_dir, 'model', 'checkpoint')
+        checkpointer = Checkpointer(filename)
+        for i in range(3):
+            checkpointer.save({'iteration': i})
+        checkpointer.close()
+        self.assertEqual(Checkpointer.load(filename), {'iteration': 2})
+
+    def test_write_failure(self):
+        # A file in place of the directory fails every write
+        blocker = os.path.join(self.work_dir, 'model')
+        open(blocker, 'w').close()
+        checkpointer = Checkpointer(os.path.join(blocker, 'checkpoint'))
+        with self.assertRaises(IOError):
+            for i in range(100):
+                checkpointer.save({'iteration': i})
+        with self.assertRaises(IOError):
+            checkpointer.close()
+
+
+if __name__ == '__main__':
+    unittest.main()
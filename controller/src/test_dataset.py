@@ -0,0 +1,194 @@
+import multiprocessing
+import os
+import shutil
+import tempfile
+import time
+import unittest
+from threading import Thread
+
+import numpy as np
+
+from dataset import DataFile, Recorder
+
+try:
+    import resource
+except ImportError:
+    resource = None
+
+CHUNK_SIZE = 16
+
+
+def frames(first, count):
+    """
+    Frames numbered from first, the number is stored in the pixels.
+    """
+    ids = np.arange(first, first + count)
+    observation = np.zeros([count, 2, 2, 3], np.uint8)
+    observation[:, 0, 0, 0] = ids // 256
+    observation[:, 0, 0, 1] = ids % 256
+    return observation, ids % 3
+
+
+def frame_ids(observation) -> list:
+    observation = np.asarray(observation)
+    return sorted((observation[:, 0, 0, 0].astype(np.int64) * 256 + observation[:, 0, 0, 1]).tolist())
+
+
+def append_chunks(data_dir, first, chunks):
+    data_file = DataFile(data_dir)
+    session = data_file.new_session()
+    for i in range(chunks):
+        data_file.append(*frames(first + i * CHUNK_SIZE, CHUNK_SIZE), session=session)
+
+
+class TwoWritersTest(unittest.TestCase):
+
+    def setUp(self):
+        self.data_dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.data_dir)
+
+    def check(self, expected_ids):
+        data_file = DataFile(self.data_dir)
+        self.assertEqual(frame_ids(data_file.observation[:]), sorted(expected_ids))
+        self.assertEqual(len(data_file.action), len(expected_ids))
+        header = DataFile.read_header(self.data_dir)
+        self.assertEqual(header['count'], len(expected_ids))
+        self.assertEqual(header, data_file.header())
+        # No chunk is left behind by a lost index entry
+        names = {chunk['name'] for chunk in data_file.index['chunks']}
+        stored = {name.split('.')[0] for name in os.listdir(self.data_dir) if name.endswith('.npy')}
+        self.assertEqual(stored, names)
+
+    def test_recorder_and_explorer(self):
+        recorder = DataFile(self.data_dir)
+        session = recorder.new_session()
+        recorder.append(*frames(0, CHUNK_SIZE), session=session)
+        explorer = DataFile(self.data_dir)
+        removed = int(explorer.observation[0][0, 0, 1])
+        explorer.remove(0)
+        explorer.compact()
+        recorder.append(*frames(CHUNK_SIZE, CHUNK_SIZE), session=session)
+        self.assertEqual(len(explorer.observation[:]), CHUNK_SIZE - 1)
+        expected = [i for i in range(2 * CHUNK_SIZE) if i != removed]
+        self.assertEqual(frame_ids(recorder.observation[:]), expected)
+        self.check(expected)
+
+    def test_concurrent_threads(self):
+        DataFile(self.data_dir).append(*frames(0, CHUNK_SIZE))
+        writers = [Thread(target=append_chunks, args=(self.data_dir, (i + 1) * 1000, 20)) for i in range(2)]
+        for writer in writers:
+            writer.start()
+        # Remove and compact while both writers append
+        explorer = DataFile(self.data_dir)
+        for _ in range(5):
+            explorer.remove(0)
+            explorer.compact()
+        for writer in writers:
+            writer.join()
+        expected = list(range(5, CHUNK_SIZE)) + [id_ for i in range(2)
+                                                 for id_ in range((i + 1) * 1000, (i + 1) * 1000 + 20 * CHUNK_SIZE)]
+        self.check(expected)
+
+    @unittest.skipUnless(hasattr(os, 'fork'), 'needs fork')
+    def test_concurrent_processes(self):
+        DataFile(self.data_dir)
+        context = multiprocessing.get_context('fork')
+        writers = [context.Process(target=append_chunks, args=(self.data_dir, (i + 1) * 1000, 20)) for i in range(2)]
+        for writer in writers:
+            writer.start()
+        for writer in writers:
+            writer.join()
+            self.assertEqual(writer.exitcode, 0)
+        self.check([id_ for i in range(2) for id_ in range((i + 1) * 1000, (i + 1) * 1000 + 20 * CHUNK_SIZE)])
+
+    @unittest.skipUnless(resource is not None, 'needs resource limits')
+    def test_many_chunks(self):
+        data_file = DataFile(self.data_dir)
+        session = data_file.new_session()
+        for i in range(300):
+            data_file.append(*frames(i, 1), session=session)
+        soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+        # Fewer files than chunks, opening a data set must not open its chunks
+        resource.setrlimit(resource.RLIMIT_NOFILE, (128, hard))
+        try:
+            data_files = [DataFile(self.data_dir).select(sessions=[session]) for _ in range(3)]
+            for i, data_file in enumerate(data_files):
+                data_file.remove(0)
+                self.assertEqual(len(data_file.action), 299 - i)
+                self.assertEqual(data_file.header()['count'], 299 - i)
+        finally:
+            resource.setrlimit(resource.RLIMIT_NOFILE, (soft, hard))
+        self.check(list(range(3, 300)))
+
+
+class ChunkedArrayTest(unittest.TestCase):
+
+    def test_index(self):
+        data_dir = tempfile.mkdtemp()
+        try:
+            data_file = DataFile(data_dir)
+            for i in range(3):
+                data_file.append(*frames(i * CHUNK_SIZE, CHUNK_SIZE))
+            observation = data_file.observation
+            self.assertEqual(frame_ids(observation[-1:]), [3 * CHUNK_SIZE - 1])
+            self.assertEqual(frame_ids([observation[-1], observation[-3 * CHUNK_SIZE]]), [0, 3 * CHUNK_SIZE - 1])
+            self.assertEqual(frame_ids(observation[CHUNK_SIZE - 2:CHUNK_SIZE + 2]),
+                             list(range(CHUNK_SIZE - 2, CHUNK_SIZE + 2)))
+            with self.assertRaises(IndexError):
+                observation[3 * CHUNK_SIZE]
+            with self.assertRaises(IndexError):
+                observation[-3 * CHUNK_SIZE - 1]
+        finally:
+            shutil.rmtree(data_dir)
+
+
+class RecorderTest(unittest.TestCase):
+
+    def setUp(self):
+        self.data_dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.data_dir)
+
+    def test_writer_failure(self):
+        data_file = DataFile(self.data_dir)
+        recorder = Recorder(data_file, chunk_size=4, max_chunks=1)
+
+        def fail(*args, **kwargs):
+            raise OSError('disk full')
+
+        data_file.append = fail
+        observation, action = frames(0, 4)
+        for i in range(4):
+            recorder.record(observation[i], action[i])
+        with self.assertRaises(IOError):
+            # The writer fails on the first chunk, recording stops at a later frame
+            for _ in range(1000):
+                recorder.record(observation[0], action[0])
+                time.sleep(0.001)
+        recorder.close()
+        self.assertIsInstance(recorder.error, OSError)
+
+    def test_slow_writer(self):
+        data_file = DataFile(self.data_dir)
+        recorder = Recorder(data_file, chunk_size=4, max_chunks=1)
+        append = data_file.append
+
+        def slow_append(*args, **kwargs):
+            time.sleep(0.02)
+            append(*args, **kwargs)
+
+        data_file.append = slow_append
+        observation, action = frames(0, 22)
+        for i in range(22):
+            recorder.record(observation[i], action[i])
+        recorder.close()
+        self.assertIsNone(recorder.error)
+        # No frame is dropped while the writer falls behind
+        self.assertEqual(frame_ids(DataFile(self.data_dir).observation[:]), list(range(22)))
+
+
+if __name__ == '__main__':
+    unittest.main()
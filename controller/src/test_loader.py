@@ -0,0 +1,66 @@
+import time
+import unittest
+
+import numpy as np
+
+from dataset import BatchSampler
+from loader import Prefetcher
+
+
+class SlowImages:
+
+    def __init__(self, images):
+        self.images = images
+        self.random = np.random.RandomState(0)
+
+    def __len__(self):
+        return len(self.images)
+
+    def __getitem__(self, index):
+        # Workers finish their batches in random order
+        time.sleep(self.random.rand() * 0.005)
+        return self.images[index]
+
+
+class FailingSampler:
+
+    def state(self) -> dict:
+        return {'batches': 0}
+
+    def sample(self) -> tuple:
+        raise IOError('chunk missing')
+
+
+class PrefetcherTest(unittest.TestCase):
+
+    def test_worker_failure(self):
+        prefetcher = Prefetcher(FailingSampler(), workers=1)
+        try:
+            with self.assertRaises(IOError):
+                prefetcher.next()
+        finally:
+            prefetcher.close()
+
+    def test_order(self):
+        images = np.arange(100 * 4, dtype=np.uint8).reshape(100, 2, 2, 1)
+        labels = np.arange(100) % 2
+        expected = BatchSampler(images, labels, 10, mirror=True, random_seed=1)
+        sampler = BatchSampler(SlowImages(images), labels, 10, mirror=True, random_seed=1)
+        prefetcher = Prefetcher(sampler, depth=4, workers=4)
+        try:
+            for _ in range(30):
+                batch_image, batch_label, _ = prefetcher.next()
+                expected_image, expected_label, _ = expected.sample()
+                np.testing.assert_array_equal(batch_image, expected_image)
+                np.testing.assert_array_equal(batch_label, expected_label)
+            state = prefetcher.state
+        finally:
+            prefetcher.close()
+        # Resuming continues right after the last batch taken
+        resumed = BatchSampler(images, labels, 10, mirror=True, random_seed=1)
+        resumed.set_state(state)
+        np.testing.assert_array_equal(resumed.sample()[0], expected.sample()[0])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -8,6 +8,7 @@ from matplotlib.figure import Figure
 import config
 from dataset import DataFile
 from cnn import CNN
+from engine import export_weights
 
 
 class TrainForm(QMainWindow):
@@ -47,6 +48,9 @@ class TrainForm(QMainWindow):
         self.check_incremental = QCheckBox("增量训练")
         self.check_incremental.setChecked(True)
         tool_panel.addWidget(self.check_incremental)
+        self.check_balanced = QCheckBox("类别均衡采样")
+        self.check_balanced.setChecked(False)
+        tool_panel.addWidget(self.check_balanced)
         self.btn_start_train = QPushButton("开始训练")
         self.btn_start_train.clicked.connect(self.train_model)
         tool_panel.addWidget(self.btn_start_train)
@@ -92,7 +96,11 @@ class TrainForm(QMainWindow):
     def train_model(self):
         # Load data
         self.setLog("正在加载数据...")
-        data_file = DataFile(config.data_file)
+        header = DataFile.read_header(config.data_dir)
+        if header is not None and header['count'] == 0:
+            self.setLog("无训练数据")
+            return
+        data_file = DataFile(config.data_dir, config.data_file).select(**config.data_filter)
         if len(data_file) == 0:
             self.setLog("无训练数据")
             return
@@ -106,12 +114,18 @@ class TrainForm(QMainWindow):
             self.model.initialize()
         # Start train
         self.setLog("正在训练模型...")
-        self.model.fit(train_obs, train_act, test_obs, test_act,
-                       batch_size=self.spin_batch_size.value(),
-                       iters=self.spin_iter.value(),
-                       print_iters=self.spin_print_iter.value(),
-                       report_func=self.report_progress)
-        self.setLog("训练完成")
+        history = self.model.fit(train_obs, train_act, test_obs, test_act,
+                                 batch_size=self.spin_batch_size.value(),
+                                 iters=self.spin_iter.value(),
+                                 print_iters=self.spin_print_iter.value(),
+                                 report_func=self.report_progress,
+                                 mirror=True,
+                                 balanced=self.check_balanced.isChecked(),
+                                 checkpoint_file=config.checkpoint_file,
+                                 checkpoint_iters=config.checkpoint_iters,
+                                 data_id=(data_file.header()['hash'], sorted(data_file.sessions)))
+        self.setLog("训练完成：训练集准确率 %.4f，验证集准确率 %.4f" %
+                    (history['final_train_acc'], history['final_val_acc']))
         self.btn_save_model.setDisabled(False)
 
     def report_progress(self, iter, hist):
@@ -150,6 +164,7 @@ class TrainForm(QMainWindow):
     def save_model(self):
         self.btn_save_model.setDisabled(True)
         self.model.save(config.model_file)
+        export_weights(config.model_file, config.engine_file)
 
     def save_image(self):
         file_name, _ = QFileDialog.getSaveFileName(self, "保存图片")
@@ -11,20 +11,23 @@ from net import build_cnn, build_mlp
 
 class NeuralNetwork:
 
-    def __init__(self, obs_dim, num_actions):
+    def __init__(self, obs_dim, num_actions, session_config=None):
         """
         Create a neural network with a single hidden layer.
         :param obs_dim: the dimension of observations
         :param num_actions: the number of discrete actions
+        :param session_config: the tf.ConfigProto of the session, e.g. to limit its thread pools
         """
-        # Placeholder
-        self.sy_obs = tf.placeholder(tf.float32, shape=[None] + list(obs_dim))
+        # Placeholder, images are fed as uint8 and cast in the graph
+        obs_type = tf.uint8 if len(obs_dim) == 3 else tf.float32
+        self.sy_obs = tf.placeholder(obs_type, shape=[None] + list(obs_dim))
         self.sy_act = tf.placeholder(tf.int32, shape=[None])
+        obs = tf.cast(self.sy_obs, tf.float32)
         # Network
         if len(obs_dim) == 1:
-            self.sy_logit = build_mlp(self.sy_obs, num_actions, "mlp")
+            self.sy_logit = build_mlp(obs, num_actions, "mlp")
         elif len(obs_dim) == 3:
-            self.sy_logit = build_cnn(self.sy_obs, num_actions, "cnn")
+            self.sy_logit = build_cnn(obs, num_actions, "cnn")
         else:
             raise ValueError("Unsupported observation dimension " + obs_dim)
         self.sy_softmax = tf.nn.softmax(self.sy_logit, 1)
@@ -34,7 +37,7 @@ class NeuralNetwork:
         train_optimizer = tf.train.AdamOptimizer()
         self.train_step = train_optimizer.minimize(self.sy_loss)
         # Initialize
-        self.sess = tf.Session()
+        self.sess = tf.Session(config=session_config)
         self.sess.run(tf.global_variables_initializer())
 
     def fit(self, observations, actions, iter, batch_size=1000, print_iter=100):
@@ -107,6 +110,8 @@ def main():
     parser.add_argument('--pre_train', '-p', type=str)
     parser.add_argument('--output', '-o', type=str)
     parser.add_argument('--shake_avoid', '-sa', action='store_true')
+    parser.add_argument('--intra_threads', type=int, default=0, help='Threads per operation, 0 for the default')
+    parser.add_argument('--inter_threads', type=int, default=0, help='Operations run at once, 0 for the default')
     args = parser.parse_args()
 
     # Create environment
@@ -117,7 +122,9 @@ def main():
     observations, actions = read_data('dataset_sim.dat')
 
     # Create neural network
-    net = NeuralNetwork(env.observation_space.shape, env.action_space.n)
+    session_config = tf.ConfigProto(intra_op_parallelism_threads=args.intra_threads,
+                                    inter_op_parallelism_threads=args.inter_threads)
+    net = NeuralNetwork(env.observation_space.shape, env.action_space.n, session_config)
 
     if args.pre_train:
         net.load(args.pre_train)